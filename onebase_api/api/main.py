@@ -27,6 +27,15 @@ from onebase_common.exceptions import OneBaseException
 from onebase_api.api.validators import validator_views
 # from onebase_api.api.representers import repr_views
 from onebase_api.api.representers import slot_views
+from onebase_api.api.nodes import node_views
+from onebase_api.services import get_client
+from onebase_api.models.main import (
+    representations,
+    key_cache,
+    slot_cache,
+)
+from onebase_api.cache import renders
+from onebase_api.models.types import TYPE_SELECTION
 from onebase_api import app
 
 
@@ -36,6 +45,7 @@ BLUEPRINTS = (
     validator_views,
     # repr_views,
     slot_views,
+    node_views,
 )
 
 
@@ -44,6 +54,37 @@ def hello():
     return ApiResponse()
 
 
+@app.route('/stats/services', methods=['GET', ])
+def service_stats():
+    """ Connection pool statistics of the type microservice client.
+
+    .. response:
+        data: `{host: {requests, errors, connections, idle}}`
+    """
+    return ApiResponse(data=get_client().pool_stats())
+
+
+@app.route('/stats/cache', methods=['GET', ])
+def cache_stats():
+    """ Hit/miss statistics of the in-process caches. """
+    return ApiResponse(data={
+        'representations': representations.stats(),
+        'renders': renders.stats(),
+        'keys': key_cache.stats(),
+        'slots': slot_cache.stats(),
+    })
+
+
+@app.route('/stats/types', methods=['GET', ])
+def type_stats():
+    """ Import time (seconds) of the types loaded so far.
+
+    .. response:
+        data: `{type name: seconds}`
+    """
+    return ApiResponse(data=dict(TYPE_SELECTION.load_times))
+
+
 for bp in BLUEPRINTS:
     app.register_blueprint(bp)
 
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+This file is part of 1Base.
+
+1Base is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+1Base is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+from json import dumps
+
+from flask import (
+    request,
+    Response,
+    stream_with_context,
+)
+
+from onebase_common import settings as common_settings
+from onebase_common.exceptions import OneBaseException
+from onebase_api.models.main import (
+    Node,
+    encode_row_token,
+)
+from onebase_api.onebase import (
+    OnebaseBlueprint,
+    )
+
+logger = logging.getLogger(__name__)
+
+node_views = OnebaseBlueprint('nodes', __name__,
+                              url_prefix='/node')
+
+MAX_LIMIT = 10000
+
+
+def _flag(name):
+    """ Read a boolean query parameter. """
+    return request.args.get(name, 'false').lower() in ('1', 'true', 'yes')
+
+
+def stream_rows(rows, limit):
+    """ Stream rows as an API response body.
+
+    The body has the same layout as an `ApiResponse`; `data.next` holds the
+    continuation token of the following page, or null on the last page.
+
+    :param rows: Iterable of `(row_num, row)` tuples.
+
+    :param limit: Page size the rows were selected with.
+    """
+    head = dumps(dict(info=common_settings.RESPONSE_INFO, status='200',
+                      message=None))
+    yield head[:-1] + ', "data": {"rows": ['
+    n_rows = 0
+    last = None
+    for (row_num, row) in rows:
+        if n_rows > 0:
+            yield ', '
+        yield dumps([row_num, row], default=str)
+        n_rows += 1
+        last = row_num
+    token = encode_row_token(last) if n_rows == limit else None
+    yield '], "next": ' + dumps(token) + '}}'
+
+
+@node_views.route('/<node_id>/rows', methods=['GET', ])
+def select_rows(node_id):
+    """ Stream the rows of a node, one page at a time.
+
+    .. request::
+        args:
+            limit:
+                type: int
+                description: maximum number of rows to return, at least 1
+                    (default 100)
+            after:
+                type: str
+                description: `next` token returned by the previous page.
+            fields:
+                type: str
+                description: comma-separated key names to return (default
+                    all keys).
+            expand_keys:
+                type: bool
+            expand_slots:
+                type: bool
+            mimetype:
+                type: str
+                description: mimetype used when expanding slots.
+
+    .. response:
+        data:
+            rows: list of `[row_num, row]`
+            next: token of the next page, null on the last page.
+    """
+    node = Node.objects(id=node_id).first()
+    if node is None:
+        raise OneBaseException('E-503', value=node_id, key='node_id')
+    try:
+        limit = min(int(request.args.get('limit', 100)), MAX_LIMIT)
+    except ValueError:
+        raise OneBaseException('E-503', value=request.args['limit'],
+                               key='limit')
+    if limit < 1:
+        raise OneBaseException('E-503', value=limit, key='limit')
+    after = request.args.get('after', None)
+    fields = request.args.get('fields', None)
+    key_names = [f for f in fields.split(',') if f] if fields else None
+    # Invalid `after` and `fields` raise here, before the response starts
+    # streaming.
+    rows = node.iter_select(None,
+                            key_names=key_names,
+                            limit=limit,
+                            after=after,
+                            expand_keys=_flag('expand_keys'),
+                            expand_slots=_flag('expand_slots'),
+                            mimetype=request.args.get('mimetype',
+                                                      'application/html'))
+    return Response(stream_with_context(stream_rows(rows, limit)),
+                    mimetype='application/json')
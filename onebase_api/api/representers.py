@@ -28,6 +28,8 @@ from flask import (
 from onebase_common import settings
 from onebase_common.log.setup import configure_logging
 from onebase_common.exceptions import OneBaseException
+from onebase_api import settings as api_settings
+from onebase_api.cache import digest
 from onebase_api.models.main import (
     Slot,
 )
@@ -41,12 +43,83 @@ slot_views = OnebaseBlueprint('representers', __name__,
                               url_prefix='/slot')
 
 
+def slot_etag(slot, view, args):
+    """ Get the strong ETag of a view of a slot.
+
+    :param slot: Slot, with at least its id and version loaded.
+
+    :param view: Name of the view, e.g. `render`.
+
+    :param args: Render parameters (the query arguments).
+
+    :return: str
+    """
+    return digest([str(slot.id), slot.version, view,
+                   sorted(args.items(multi=True))])
+
+
+def conditional_view(slot_id, view, respond):
+    """ Answer a GET of a slot view, honouring `If-None-Match`.
+
+    The slot and its key are read through the identity maps, so a client
+    holding a fresh copy is answered without rendering anything and, in the
+    steady state, without reading the database.
+
+    A type may set its own ETag on the response (see `ColorType.respond`);
+    it then wins over the slot's, since the type already used it to answer
+    conditional and Range requests.
+
+    :param respond: Function taking the slot and its ETag, and returning
+        the response.
+    """
+    slot = Slot.cached(slot_id)
+    if slot is None:
+        raise OneBaseException('E-503', value=slot_id, key='slot_id')
+    etag = slot_etag(slot, view, request.args)
+    cache_control = slot.type.CACHE_CONTROL
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = respond(slot, etag)
+    if 'ETag' not in response.headers:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+@slot_views.route('/attrs', methods=['POST', ])
+def get_attrs_batch():
+    """ Get the attributes of many slots at once.
+
+    .. request::
+        body:
+            ids: list of slot IDs, at most `SLOT_ATTRS_BATCH_SIZE`.
+            mimetype: optional requested mimetype.
+
+    .. response:
+        data: `{slot_id: attrs}`; attrs are null for slots that do not
+            exist or failed to render.
+    """
+    body = request.get_json()
+    if not isinstance(body, dict) or not isinstance(body.get('ids'), list):
+        raise OneBaseException('E-102', keys=['ids', ])
+    ids = body['ids']
+    if len(ids) > api_settings.SLOT_ATTRS_BATCH_SIZE:
+        raise OneBaseException('E-503', value=len(ids), key='ids')
+    requested_mimetype = body.get('mimetype', None) or 'application/html'
+    return ApiResponse(data=Slot.get_attrs_many(ids, requested_mimetype))
+
+
 @slot_views.route('/attrs/<slot_id>', methods=['GET', ])
 def get_attrs(slot_id):
-    slot = Slot.objects(id=slot_id).first()
-    return ApiResponse(data=slot.get_attrs(**request.args))
+    return conditional_view(
+        slot_id, 'attrs',
+        lambda slot, etag: ApiResponse(data=slot.get_attrs(**request.args)))
 
 @slot_views.route('/render/<slot_id>', methods=['GET', ])
 def render_slot(slot_id):
-    slot = Slot.objects(id=slot_id).first()
-    return slot.respond(**request.args)
+    return conditional_view(
+        slot_id, 'render',
+        lambda slot, etag: slot.respond(
+            etag=etag,
+            **{k: v for (k, v) in request.args.items() if k != 'etag'}))
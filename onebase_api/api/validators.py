@@ -35,6 +35,8 @@ from onebase_api.onebase import (
     ApiResponse,
     OnebaseBlueprint,
     )
+from onebase_api.services import register_local_service
+from onebase_api.models.types import fits_size
 from onebase_api import app
 
 configure_logging()
@@ -80,32 +82,66 @@ def make_validation_response(is_valid, ok_status=STATUS.OK,
     else:
         return ApiResponse(status=error_status)
 
-def get_parts():
-    body = request.get_json()
+def parse_parts(body):
+    """ Get the `(value, size)` of a validation request body. """
+    if not isinstance(body, dict):
+        raise OneBaseException('E-102', keys=['value', 'size'])
     for req in ('value', 'size'):
-        if not body.get(req, None):
+        if req not in body or body[req] is None:
             raise OneBaseException('E-102', keys=[req, ])
-    return (str(body['value']), int(body['size']))
+    try:
+        size = int(body['size'])
+    except (TypeError, ValueError):
+        raise OneBaseException('E-503', value=body['size'], key='size')
+    return (str(body['value']), size)
 
-def basic_regex_validation(REGEX_FUNC):
-    """ Validate a slot by a given regex `match` function.
+def get_parts():
+    return parse_parts(request.get_json())
+
+def regex_check(REGEX_FUNC):
+    """ Make a check of a value by a given regex `match` function.
 
-    This method will also check the length of the value. If the length of the
+    The check will also check the length of the value. If the length of the
     `Type` is greater than the length of the slot, return False.
 
     :param REGEX_FUNC: Regular expression `match` function (or similar)
 
+    :return: function of `(value, length)` returning True if the value is
+        valid, False otherwise.
+    """
+    def check(value, length):
+        if len(value) > length:
+            raise OneBaseException('E-100',
+                                   key='value',
+                                   expected=length,
+                                   given=len(value))
+        if not REGEX_FUNC(value):
+            raise OneBaseException('E-101', message="Invalid format")
+        return fits_size(value, length) and bool(REGEX_FUNC(value))
+    return check
+
+def length_check(value, length):
+    """ Check only the length of a value. """
+    return fits_size(value, length)
+
+def basic_regex_validation(REGEX_FUNC):
+    """ Validate a slot by a given regex `match` function.
+
+    :see: regex_check
+
     :return: True if request's value is valid, False otherwise.
     """
-    (value, length) = get_parts()
-    if len(value) > length:
-        raise OneBaseException('E-100',
-                               key='value',
-                               expected=length,
-                               given=len(value))
-    if not REGEX_FUNC(value):
-        raise OneBaseException('E-101', message="Invalid format")
-    return (length is not None) and (len(value) < length and REGEX_FUNC(value))
+    return regex_check(REGEX_FUNC)(*get_parts())
+
+""" Checks of each validator, by name. Used by the batch validators.
+"""
+CHECKS = {
+    'int': regex_check(RE_INT),
+    'string': length_check,
+    'boolean': regex_check(RE_BOOLEAN),
+    'float': regex_check(RE_FLOAT),
+    'image': regex_check(RE_URI),
+}
 
 
 @validator_views.route('/', methods=['GET', ])
@@ -162,8 +198,7 @@ def validate_str():
         status: 200 if validation passes, another error code otherwise.
 
     """
-    (value, length) = get_parts()
-    return make_validation_response(len(value) < length)
+    return make_validation_response(length_check(*get_parts()))
 
 
 @validator_views.route('/boolean', methods=['POST', ])
@@ -222,3 +257,51 @@ def validate_image():
         status: 200 if validation passes, another error code otherwise.
     """
     return make_validation_response(basic_regex_validation(RE_URI))
+
+
+@validator_views.route('/<type_name>/batch', methods=['POST', ])
+def validate_batch(type_name):
+    """ Validate many values of a type at once.
+
+    .. request::
+        body:
+            type: list
+            description: list of `{value, size}` objects, as given to the
+                single-value validator of the type.
+
+    .. response:
+        status: 200 unless the request itself is invalid.
+        data:
+            results: list of `{valid, error}` objects, in request order.
+                `error` is null for valid values.
+    """
+    check = CHECKS.get(type_name, None)
+    if check is None:
+        raise OneBaseException('E-503', value=type_name, key='type')
+    items = request.get_json()
+    if not isinstance(items, list):
+        raise OneBaseException('E-102', keys=['items', ])
+    results = []
+    for item in items:
+        try:
+            results.append({'valid': bool(check(*parse_parts(item))),
+                            'error': None})
+        except OneBaseException as obe:
+            results.append({'valid': False,
+                            'error': {'error_code': obe.error_code,
+                                      'message': str(obe)}})
+        except Exception as e:
+            # One bad item must not fail the others.
+            logger.exception(e)
+            results.append({'valid': False,
+                            'error': {'error_code': 'E-101',
+                                      'message': str(e)}})
+    return ApiResponse(data={'results': results})
+
+
+def _local(check):
+    return lambda body: check(*parse_parts(body))
+
+for (name, check) in CHECKS.items():
+    register_local_service(validator_views.url_prefix + '/' + name,
+                           _local(check))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+This file is part of 1Base.
+
+1Base is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+1Base is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from json import dumps
+
+from onebase_api import settings
+
+logger = logging.getLogger(__name__)
+
+
+def digest(value):
+    """ Get a stable digest of a JSON-like value. """
+    raw = dumps(value, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()
+
+
+class LRUCache(object):
+    """ Thread-safe, size-bounded LRU cache with optional expiry. """
+
+    MISSING = object()
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """ Construct a new LRUCache.
+
+        :param maxsize: Maximum number of entries. The least recently used
+            entry is evicted when full.
+
+        :param ttl: Seconds an entry stays valid, or None to never expire.
+
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        # Bumped by every invalidation, see `get_or_load`.
+        self._generation = 0
+
+    def get(self, key, default=None):
+        """ Get a cached value, or `default` if missing or expired. """
+        with self._lock:
+            entry = self._data.get(key, None)
+            if entry is not None:
+                (expires, value) = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, generation=None):
+        """ Cache a value.
+
+        :param generation: `generation` read before the value was loaded.
+            If given, the value is only cached if no entry was invalidated
+            since, as it may predate the change the invalidation was for.
+
+        :return: True if the value was cached.
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._store(key, value)
+            return True
+
+    @property
+    def generation(self):
+        """ Counter bumped by every invalidation, see `set`. """
+        with self._lock:
+            return self._generation
+
+    def _store(self, key, value):
+        """ Cache a value. Call with the lock held. """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_load(self, key, load):
+        """ Get a cached value, loading and caching it on a miss.
+
+        A value loaded while any entry was invalidated is returned but not
+        cached, as it may predate the change the invalidation was for.
+
+        :param load: Function taking no arguments and returning the value.
+            None is returned but never cached.
+        """
+        value = self.get(key, self.MISSING)
+        if value is not self.MISSING:
+            return value
+        generation = self.generation
+        value = load()
+        if value is not None:
+            self.set(key, value, generation=generation)
+        return value
+
+    def invalidate(self, key):
+        """ Drop a single entry. """
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """ Drop every entry whose key matches `predicate`.
+
+        :return: Number of entries dropped.
+        """
+        with self._lock:
+            self._generation += 1
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        """ Get hit/miss counters and the size of the cache. """
+        with self._lock:
+            return dict(size=len(self._data), maxsize=self.maxsize,
+                        hits=self.hits, misses=self.misses,
+                        evictions=self.evictions)
+
+
+class ContentStore(object):
+    """ Two-tier store of rendered content, addressed by the digest of what
+    it was rendered from.
+
+    Content is looked up in an in-memory `LRUCache` first, then in
+    `directory` (shared by every worker process), and only made when both
+    miss. As the address depends on nothing but the source, it doubles as a
+    strong ETag.
+    """
+
+    def __init__(self, directory=None, maxsize=1024):
+        """ Construct a new ContentStore.
+
+        :param directory: Directory of the on-disk tier, or None to keep
+            content in memory only.
+
+        :param maxsize: Maximum number of entries kept in memory.
+
+        """
+        self.directory = directory
+        self.memory = LRUCache(maxsize)
+        self.disk_hits = 0
+        self.disk_writes = 0
+
+    def get_or_make(self, source, make):
+        """ Get the content made from `source`, making it if needed.
+
+        :param source: JSON-like value the content depends on.
+
+        :param make: Function taking no arguments and returning the content
+            as bytes.
+
+        :return: tuple of `(address, content)`
+        """
+        address = digest(source)
+        content = self.memory.get(address)
+        if content is None:
+            content = self._read(address)
+            if content is None:
+                content = make()
+                self._write(address, content)
+            self.memory.set(address, content)
+        return (address, content)
+
+    def _path(self, address):
+        return os.path.join(self.directory, address[:2], address)
+
+    def _read(self, address):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(address), 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        self.disk_hits += 1
+        return content
+
+    def _write(self, address, content):
+        """ Write atomically, so readers never see a partial file. """
+        if self.directory is None:
+            return
+        path = self._path(address)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warn('could not store {}: {}'.format(path, e))
+            return
+        self.disk_writes += 1
+
+    def stats(self):
+        """ Get the statistics of the memory tier and disk counters. """
+        stats = self.memory.stats()
+        stats.update(disk_hits=self.disk_hits, disk_writes=self.disk_writes)
+        return stats
+
+
+# Rendered images of the types, e.g. color swatches.
+renders = ContentStore(settings.RENDER_CACHE_DIR, settings.RENDER_CACHE_SIZE)
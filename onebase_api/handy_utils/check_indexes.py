@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+This file is part of 1Base.
+
+1Base is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+1Base is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import argparse
+import sys
+
+from mongoengine import connect
+
+from onebase_api.models.main import (
+    Slot,
+    Key,
+    Node,
+    Path,
+    RowSequence,
+)
+from onebase_api.models.auth import (
+    User,
+)
+from onebase_api.models.discussion import (
+    Comment,
+    DeletedComment,
+)
+
+logger = logging.getLogger(__name__)
+
+help = """ Compare the live MongoDB indexes against the indexes declared by the
+models.
+
+Reports missing, undeclared and unused indexes, and optionally builds the
+missing ones in the background.
+"""
+
+MODELS = (
+    Slot,
+    Key,
+    Node,
+    Path,
+    RowSequence,
+    User,
+    Comment,
+    DeletedComment,
+)
+
+parser = argparse.ArgumentParser(description=help)
+
+parser.add_argument('database', help='Name of the database to check.')
+parser.add_argument('--host', default=None, help='MongoDB host.')
+parser.add_argument('--build', action='store_true',
+                    help='Build missing indexes (in the background).')
+
+
+def unused_indexes(model):
+    """ Get names of the indexes of a model that were never used.
+
+    Usage is counted by MongoDB since the last server restart.
+    """
+    stats = model._get_collection().aggregate([{'$indexStats': {}}])
+    return [s['name'] for s in stats
+            if s['name'] != '_id_' and s['accesses']['ops'] == 0]
+
+
+def check(model, build=False):
+    """ Check (and optionally build) the indexes of a model.
+
+    :return: True if no index is missing.
+    """
+    name = model.__name__
+    diff = model.compare_indexes()
+    for spec in diff['missing']:
+        print('{}: missing index {}'.format(name, spec))
+    for spec in diff['extra']:
+        print('{}: undeclared index {}'.format(name, spec))
+    for index_name in unused_indexes(model):
+        print('{}: unused index {}'.format(name, index_name))
+    if build and diff['missing']:
+        print('{}: building {} index(es)...'
+              .format(name, len(diff['missing'])))
+        model.ensure_indexes()
+    return not diff['missing']
+
+
+def main(inargs=sys.argv[1:]):
+    args = parser.parse_args(inargs)
+    connect(args.database, host=args.host)
+    ok = True
+    for model in MODELS:
+        ok = check(model, args.build) and ok
+    return 0 if ok or args.build else 1
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -93,6 +93,11 @@ class User(JsonMixin, DynamicDocument):
     # Frilly information
     avatar = ForgivingURLField()
 
+    meta = {
+        'indexes': [{'fields': ['api_key', ], 'sparse': True}, ],
+        'index_background': True,
+    }
+
     def __init__(self, *args, **kwargs):
         """ Construct a new user. """
         self.is_authenticated = False
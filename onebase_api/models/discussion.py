@@ -52,7 +52,8 @@ class CommentBase(Document, JsonMixin, TimestampOrderableMixin):
     replies = SortedListField(ReferenceField('Comment'), default=list())
     timestamp = DateTimeField(required=True, default=datetime.now())
 
-    meta = {'allow_inheritance': True, 'abstract': True, }
+    meta = {'allow_inheritance': True, 'abstract': True,
+            'indexes': ['replies', ], 'index_background': True, }
 
     @property
     def parent(self):
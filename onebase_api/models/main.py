@@ -17,10 +17,18 @@ along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import logging
-from json import dumps
+import base64
+import binascii
+from json import dumps, loads
 
 from os.path import join
 import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    wait,
+)
+from types import SimpleNamespace
 from urllib import (
     parse,
 )
@@ -38,6 +46,7 @@ from mongoengine import (
     IntField as IntegerField,
     BooleanField,
     ListField,
+    DateTimeField,
     ReferenceField,
     Document,
     DynamicField,
@@ -48,9 +57,24 @@ from mongoengine import (
     EmbeddedDocument,
     EmbeddedDocumentListField,
     UUIDField,
+    Q,
+    ValidationError,
 )
 import requests
-
+from bson import ObjectId
+from pymongo import UpdateMany, ReturnDocument
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from onebase_api import settings as api_settings
+from onebase_api.cache import (
+    LRUCache,
+    digest,
+)
+from onebase_api.services import (
+    get_client,
+    local_service,
+)
+from onebase_api.utils import run_in_background
 from onebase_api.models.discussion import (
     Discussion
 )
@@ -59,7 +83,11 @@ from onebase_common.models.mixin import (
     HistoricalMixin,
     DiscussionMixin,
 )
-from onebase_api.models.types import TYPE_SELECTION
+from onebase_api.models.types import (
+    TYPE_SELECTION,
+    fits_size,
+)
+from onebase_api.models import query
 from onebase_common.util import (
     path_split,
     path_head_tail,
@@ -68,6 +96,43 @@ from onebase_common.util import (
 
 logger = logging.getLogger(__name__)
 
+""" Cache of the representations returned by remote representers, keyed by
+`(type name, value digest, environment digest)`.
+"""
+representations = LRUCache(maxsize=api_settings.REPR_CACHE_SIZE,
+                           ttl=api_settings.REPR_CACHE_TTL)
+
+""" Identity maps of the Keys and Slots read by the slot routes, keyed by
+document id (str). See `Key.cached` and `Slot.cached`.
+"""
+key_cache = LRUCache(maxsize=api_settings.KEY_CACHE_SIZE,
+                     ttl=api_settings.KEY_CACHE_TTL)
+slot_cache = LRUCache(maxsize=api_settings.SLOT_CACHE_SIZE,
+                      ttl=api_settings.SLOT_CACHE_TTL)
+
+
+def encode_row_token(row_num):
+    """ Make an opaque continuation token for keyset pagination.
+
+    :param row_num: Last row number returned to the client.
+
+    :return: URL-safe token string.
+    """
+    raw = dumps({'r': row_num}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_row_token(token):
+    """ Decode a token made by `encode_row_token`.
+
+    :return: The row number the token continues after.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token.encode('ascii'))
+        return int(loads(raw.decode('utf-8'))['r'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise OneBaseException('E-503', value=token, key='after')
+
 
 class Type(JsonMixin, Document):
     """ Basic type for databases. """
@@ -95,13 +160,78 @@ class Type(JsonMixin, Document):
             'value': value,
             'size': size,
         }
+        local = self._local_type(self.validator)
+        if local is not None:
+            if fits_size(value, size) and local.instance().validate(value):
+                return True
+            raise OneBaseException('E-101', message='Invalid value')
+        check = local_service(self.validator)
+        if check is not None:
+            # Served by this app: call it directly instead of over HTTP.
+            try:
+                if check(data):
+                    return True
+            except OneBaseException as e:
+                raise OneBaseException('E-101', message=str(e))
+            raise OneBaseException('E-101', message='Invalid value')
         logger.debug('validating {} with {}'
                      .format(data, self.validator))
-        response = requests.post(self.validator, json=data, headers=headers)
+        response = self._post(self.validator, json=data, headers=headers)
         if response.status_code == 200:
             return True
         raise OneBaseException('E-101', message=response.content)
 
+    def validate_values(self, values, size, chunk_size=None):
+        """ Validate many values with the batch validator of the type.
+
+        Built-in types validate the whole column in-process, and validators
+        served by this app are called directly. Other values are sent to
+        `<validator>/batch` in chunks of `chunk_size` values, i.e. one
+        request per chunk instead of one per value.
+
+        :param values: Values to validate.
+
+        :param size: Size of the values (given by the Key)
+
+        :param chunk_size: Values per request.
+            default=settings.VALIDATE_BATCH_SIZE
+
+        :return: list of booleans, True for each valid value.
+
+        """
+        values = list(values)
+        local = self._local_type(self.validator)
+        if local is not None:
+            invalid = local.instance().validate_many(values)
+            return [fits_size(v, size) and not bool(bad)
+                    for (v, bad) in zip(values, invalid)]
+        if not self.validator:
+            raise OneBaseException('E-101', message='Type {} has no '
+                                   'validator'.format(self.name))
+        check = local_service(self.validator)
+        if check is not None:
+            valid = []
+            for v in values:
+                try:
+                    valid.append(bool(check({'value': v, 'size': size})))
+                except OneBaseException:
+                    valid.append(False)
+            return valid
+        chunk_size = chunk_size or api_settings.VALIDATE_BATCH_SIZE
+        url = self.validator.rstrip('/') + '/batch'
+        valid = []
+        for start in range(0, len(values), chunk_size):
+            data = [{'value': v, 'size': size}
+                    for v in values[start:start+chunk_size]]
+            logger.debug('validating {} values with {}'
+                         .format(len(data), url))
+            response = self._post(url, json=data)
+            if response.status_code != 200:
+                raise OneBaseException('E-101', message=response.content)
+            results = response.json()['data']['results']
+            valid.extend(r['valid'] for r in results)
+        return valid
+
     def represent_value(self, value, headers={}, environment={}):
         """ Represent a value.
 
@@ -116,12 +246,63 @@ class Type(JsonMixin, Document):
         """
         headers = headers or {}
         data = {'value': value, 'environment': environment}
+        local = self._local_type(self.repr)
+        if local is not None:
+            return local.instance().render(SimpleNamespace(value=value),
+                                           **environment)
+        represent = local_service(self.repr)
+        if represent is not None:
+            return represent(data)
+        # Representations are deterministic for the same value and
+        # environment, so remote ones are cached.
+        cache_key = (self.name, digest(value), digest(environment))
+        text = representations.get(cache_key)
+        if text is not None:
+            return text
         logger.debug('representing {} with {}'.format(data, self.repr))
-        response = requests.post(self.repr, json=data, headers=headers)
+        response = self._post(self.repr, json=data, headers=headers,
+                              hedge_after=api_settings.SERVICE_HEDGE_AFTER)
         if response.status_code == 200:
+            representations.set(cache_key, response.text)
             return response.text
         raise OneBaseException('E-101', message=response.content)
 
+    def save(self, *args, **kwargs):
+        """ Save the type.
+
+        Cached representations of the type are dropped if `repr` changed.
+        """
+        repr_changed = 'repr' in self._get_changed_fields()
+        result = super(Type, self).save(*args, **kwargs)
+        if repr_changed:
+            representations.invalidate_where(lambda k: k[0] == self.name)
+        return result
+
+    def _post(self, url, **kwargs):
+        """ POST to a microservice of the type.
+
+        Timeouts, unreachable services and open circuit breakers are raised
+        as OneBaseException, like invalid values.
+
+        :see: onebase_api.services.ServiceClient.post
+        """
+        try:
+            return get_client().post(url, **kwargs)
+        except requests.RequestException as e:
+            logger.error('calling {} failed: {}'.format(url, e))
+            raise OneBaseException('E-101', message=str(e))
+
+    def _local_type(self, url):
+        """ Get the built-in type class to use instead of a microservice.
+
+        :param url: URL of the microservice (`validator` or `repr`).
+
+        :return: The class from `TYPE_SELECTION`, or None if `url` is set or
+            the type is not built in.
+        """
+        if url:
+            return None
+        return TYPE_SELECTION.get((self.name or '').upper(), None)
 
     @classmethod
     def as_select(cls):
@@ -148,6 +329,24 @@ class Key(DiscussionMixin, HistoricalMixin, JsonMixin):
         """ Get the class type associated with this key. """
         return TYPE_SELECTION[self.soft_type]
 
+    @classmethod
+    def cached(cls, key_id):
+        """ Get a key through the per-process identity map.
+
+        :return: The Key, or None if it does not exist.
+        """
+        return key_cache.get_or_load(
+            str(key_id), lambda: cls.objects(id=key_id).first())
+
+    def save(self, *args, **kwargs):
+        result = super(Key, self).save(*args, **kwargs)
+        key_cache.invalidate(str(self.id))
+        return result
+
+    def delete(self, *args, **kwargs):
+        key_cache.invalidate(str(self.id))
+        return super(Key, self).delete(*args, **kwargs)
+
     @property
     def node(self):
         return Node.objects(keys__in=[self.id, ]).first()
@@ -168,19 +367,245 @@ class Node(DiscussionMixin, HistoricalMixin, Document):
     keys = ListField(LazyReferenceField(Key, passthrough=False),
                      required=True)
     rows = ListField(UUIDField())
+    # Number of rows. None for nodes saved before rows were counted, see
+    # `_backfill_row_total`.
+    row_total = IntegerField()
+    rows_synced = DateTimeField()
+    # Set while `compact_rows` runs, so that only one run at a time
+    # renumbers the rows.
+    compacting = DateTimeField()
+
+    meta = {
+        'indexes': ['keys', ],
+        'index_background': True,
+    }
+
+    def syncronize_rows(self, incremental=False):
+        """ Syncronize the row IDs.
+
+        The row IDs are grouped and ordered by the server, so no Slot is
+        loaded into Python.
+
+        :param incremental: Only look at slots saved since the last
+            syncronization, appending rows that are not indexed yet. Rows
+            removed with `drop_rows` are already unindexed, so this is enough
+            after the first full syncronization.
+
+        """
+        synced = datetime.utcnow()
+        incremental = incremental and self.rows_synced is not None
+        since = self.rows_synced if incremental else None
+        row_ids = [uuid.UUID(str(row_id))
+                   for (row_id, _) in self._row_order(since)]
+        if incremental:
+            known = set(self.rows)
+            self.rows.extend(r for r in row_ids if r not in known)
+        else:
+            self.rows = row_ids
+        self.row_total = len(self.rows)
+        self.rows_synced = synced
+
+    def _backfill_row_total(self):
+        """ Build the row index of a node saved before rows were counted.
+
+        The index is rebuilt from the slots and stored, unless another
+        process did so in the meantime.
+
+        :return: True if the index was rebuilt.
+        """
+        if self.row_total is not None:
+            return False
+        if self.id is None:
+            self.row_total = len(self.rows)
+            return False
+        logger.info('Building the row index of node {}'.format(self.id))
+        self.syncronize_rows()
+        Node.objects(id=self.id, row_total=None).update_one(
+            set__rows=self.rows,
+            set__row_total=self.row_total,
+            set__rows_synced=self.rows_synced)
+        self._forget_changes('rows', 'row_total', 'rows_synced')
+        return True
+
+    def _forget_changes(self, *fields):
+        """ Unmark fields already updated on the server, so that a later
+        `save` does not overwrite concurrent updates with this copy.
+        """
+        self._changed_fields = [f for f in self._changed_fields
+                                if f.split('.')[0] not in fields]
+
+    def index_rows(self, *row_ids):
+        """ Add new rows to the row index and the row counter.
 
-    def syncronize_rows(self):
-        """ Syncronize the row IDs. """
-        slots = Slot.objects(key__in=self.get_keys).all()
-        self.rows = []
-        for s in slots:
-            if s.row_id not in self.rows:
-                self.rows.append(s.row_id)
+        The update is applied atomically on the server so concurrent writers
+        never lose a row.
 
-    def drop_rows(self, *row_ids):
-        """ Drop rows with the given row_id. """
+        :param row_ids: Row IDs of the new rows, in row order.
+
+        :return: The new row count.
+        """
+        row_ids = list(row_ids)
+        if self._backfill_row_total():
+            # The rebuilt index already has the rows that were saved.
+            known = set(self.rows)
+            row_ids = [r for r in row_ids if r not in known]
+        if not row_ids:
+            return self.row_total
+        if self.id is not None:
+            node = (Node.objects(id=self.id).only('row_total')
+                    .modify(new=True,
+                            inc__row_total=len(row_ids),
+                            push_all__rows=row_ids))
+            self.row_total = node.row_total
+            self.rows.extend(row_ids)
+            self._forget_changes('rows', 'row_total')
+        else:
+            self.row_total += len(row_ids)
+            self.rows.extend(row_ids)
+        return self.row_total
+
+    def unindex_rows(self, *row_ids):
+        """ Remove rows from the row index and the row counter.
+
+        The counter is recomputed from the index in the same (atomic) update,
+        so row IDs that were not indexed do not skew it.
+
+        :param row_ids: Row IDs (UUIDs or strings) of the removed rows.
+
+        :return: The new row count.
+        """
+        row_ids = {uuid.UUID(str(r)) for r in row_ids}
+        self._backfill_row_total()
+        if not row_ids:
+            return self.row_total
+        self.rows = [r for r in self.rows if uuid.UUID(str(r)) not in row_ids]
+        if self.id is None:
+            self.row_total = len(self.rows)
+            return self.row_total
+        to_mongo = self._fields['rows'].field.to_mongo
+        dropped = [to_mongo(r) for r in row_ids]
+        node = Node._get_collection().find_one_and_update(
+            {'_id': self.id},
+            [
+                {'$set': {'rows': {'$filter': {
+                    'input': '$rows',
+                    'cond': {'$not': [{'$in': ['$$this', dropped]}]},
+                }}}},
+                {'$set': {'row_total': {'$size': '$rows'}}},
+            ],
+            projection={'row_total': True},
+            return_document=ReturnDocument.AFTER)
+        self.row_total = node['row_total']
+        self._forget_changes('rows', 'row_total')
+        return self.row_total
+
+    def drop_rows(self, *row_ids, **kwargs):
+        """ Drop rows with the given row_id.
+
+        All slots of the rows are deleted with a single `delete_many` and the
+        row index is updated atomically.
+
+        :param compact: If True, start `compact_rows` in the background
+            afterwards. default=False
+
+        """
         Slot.objects(key__in=self.keys, row_id__in=row_ids).delete()
-        slot.syncronize_rows()
+        slot_cache.clear()
+        self.unindex_rows(*row_ids)
+        if kwargs.get('compact', False):
+            run_in_background(self.compact_rows)
+
+    def _row_order(self, since=None):
+        """ Get `(row_id, row_num)` of every row, in row order.
+
+        :param since: If given, only look at slots saved since then.
+        """
+        match = {'key': {'$in': [k.id for k in self.keys]}}
+        if since is not None:
+            match['updated'] = {'$gte': since}
+        pipeline = [
+            {'$match': match},
+            {'$group': {'_id': '$row_id', 'row_num': {'$min': '$row_num'}}},
+            {'$sort': {'row_num': 1}},
+        ]
+        result = Slot._get_collection().aggregate(pipeline, allowDiskUse=True)
+        return [(r['_id'], r['row_num']) for r in result]
+
+    def compact_rows(self, batch_size=None):
+        """ Renumber the rows so that row numbers have no gaps.
+
+        Rows keep their relative order and are moved down in batches of
+        `batch_size` rows, each batch being a single `bulk_write`, so readers
+        are never blocked. Moving rows in ascending order never collides with
+        the `(key, row_num)` unique index. Rows inserted while compacting get
+        row numbers above every compacted row and are left alone.
+
+        Only one run per node renumbers rows at a time; others return right
+        away. A run that died is taken over after
+        `settings.COMPACT_LOCK_TIMEOUT` seconds.
+
+        :param batch_size: Rows renumbered per batch.
+            default=settings.COMPACT_BATCH_SIZE
+
+        :return: Number of rows that were renumbered.
+        """
+        # Stored with millisecond precision, like every BSON date.
+        started = datetime.utcnow()
+        started = started.replace(microsecond=started.microsecond // 1000 * 1000)
+        expired = started - timedelta(seconds=api_settings.COMPACT_LOCK_TIMEOUT)
+        locked = Node.objects(Q(compacting=None) | Q(compacting__lt=expired),
+                              id=self.id).update_one(set__compacting=started)
+        if not locked:
+            logger.info('node {} is already being compacted'.format(self.id))
+            return 0
+        try:
+            return self._compact_rows(batch_size)
+        finally:
+            Node.objects(id=self.id, compacting=started).update_one(
+                unset__compacting=True)
+
+    def _compact_rows(self, batch_size):
+        batch_size = batch_size or api_settings.COMPACT_BATCH_SIZE
+        seq_name = 'node:{}'.format(self.id)
+        seq = RowSequence.objects(name=seq_name).first()
+        key_ids = [k.id for k in self.keys]
+        order = self._row_order()
+        moves = [(row_id, new_num)
+                 for (new_num, (row_id, row_num)) in enumerate(order)
+                 if row_num != new_num]
+        collection = Slot._get_collection()
+        for start in range(0, len(moves), batch_size):
+            ops = [UpdateMany({'key': {'$in': key_ids}, 'row_id': row_id},
+                              {'$set': {'row_num': new_num}})
+                   for (row_id, new_num) in moves[start:start+batch_size]]
+            collection.bulk_write(ops, ordered=True)
+            slot_cache.clear()
+            logger.debug('compacted {} rows of node {}'
+                         .format(start + len(ops), self.id))
+        if seq is not None:
+            # Hand out the freed row numbers above the highest one in use,
+            # unless rows were allocated in the meantime. Rows allocated
+            # before `order` was read may be written since, so the highest
+            # row number is read again rather than taken from `order`.
+            last = (Slot.objects(key__in=key_ids).order_by('-row_num')
+                    .only('row_num').first())
+            free = 0 if last is None else last.row_num + 1
+            if free < seq.value:
+                RowSequence.reset(seq_name, free, expected=seq.value)
+        return len(moves)
+
+    def allocate_rows(self, count=1):
+        """ Atomically allocate row numbers for new rows.
+
+        :param count: How many row numbers to allocate.
+
+        :return: `range` of the allocated row numbers.
+        """
+        def seed():
+            last = (Slot.objects(key__in=self.keys).order_by('-row_num')
+                    .only('row_num').first())
+            return 0 if last is None else last.row_num + 1
+        return RowSequence.allocate('node:{}'.format(self.id), count, seed)
 
     def get_keys(self):
         """ Get keys of the node. """
@@ -195,14 +620,15 @@ class Node(DiscussionMixin, HistoricalMixin, Document):
         :return: Row ID of specified row_num, or 0 if no rows are found.
 
         """
-        rc = self.row_count
-        if rc is 0:
-            return 0
-        row_num = row_num or rc-1
-        slot = Slot.objects(key__in=self.keys, row_num=row_num).first()
+        slots = Slot.objects(key__in=self.keys).only('row_id')
+        if row_num is None:
+            # Row numbers may have gaps, so the last row has the highest.
+            slot = slots.order_by('-row_num').first()
+        else:
+            slot = slots.filter(row_num=row_num).first()
         if not slot:
             return 0
-        return slot.row_num
+        return slot.row_id
 
     def insert(self, user, *slot_params, **kwargs):
         """ Insert a new row with a list of slot definitions.
@@ -236,6 +662,12 @@ class Node(DiscussionMixin, HistoricalMixin, Document):
         :`swallow`:
             Ignore the error and continue as if nothing happened.
 
+        :param bulk: If True, validate the whole batch first and write it with
+            `insert_many`. See `_bulk_insert`. default=False
+
+        :param chunk_size: Slots written per `insert_many` in bulk mode.
+            default=settings.INSERT_CHUNK_SIZE
+
         :return: Number of rows inserted.
 
         """
@@ -248,48 +680,187 @@ class Node(DiscussionMixin, HistoricalMixin, Document):
         if error_action not in ('give_up', 'rollback', 'swallow'):
             raise AttributeError("Invalid `error_action`")
 
+        if kwargs.get('bulk', False):
+            chunk_size = kwargs.get('chunk_size',
+                                    api_settings.INSERT_CHUNK_SIZE)
+            return self._bulk_insert(slot_params, error_action, chunk_size)
+
         n_rows = 0
         _rollback = []
+        _indexed = []
 
         for slot_row in slot_params:
-            for slot_args in slot_row:
-                try:
-                    # Generate a unique uuid for this row.
-                    insert_row_id = uuid.uuid4.hex()
-                    self.rows.append(insert_row_id)
+            # Generate a unique uuid for this row.
+            insert_row_id = uuid.uuid4()
+            try:
+                insert_row_num = self.allocate_rows(1).start
+                for slot_args in slot_row:
                     slot_args['row_id'] = insert_row_id
-                    slot = Slot(*slot_args)
+                    slot_args['row_num'] = insert_row_num
+                    slot = Slot(**slot_args)
                     _rollback.append(slot)
                     slot.save(user, do_row_sync=False)
-                except Exception as e:
-                    if error_action == 'give_up':
-                        raise e
-                    if error_action == 'rollback':
-                        for r in _rollback:
-                            logger.warn('ROLL BACK {}...'.format(r))
-                            Slot.objects(id=r.id).delete()
-                        raise e
-                    if error_action == 'swallow':
-                        logger.error(e)
-                        logger.error('swallow action, so continuing...')
-                finally:
-                    n_rows += 1
+                self.index_rows(insert_row_id)
+                _indexed.append(insert_row_id)
+                n_rows += 1
+            except Exception as e:
+                if error_action == 'give_up':
+                    raise e
+                if error_action == 'rollback':
+                    for r in _rollback:
+                        logger.warn('ROLL BACK {}...'.format(r))
+                        r.delete()
+                    self.unindex_rows(*_indexed)
+                    raise e
+                if error_action == 'swallow':
+                    logger.error(e)
+                    logger.error('swallow action, so continuing...')
         return n_rows
 
+    def _bulk_insert(self, slot_params, error_action, chunk_size):
+        """ Insert a batch of rows with a constant number of round trips.
+
+        Every row is validated before anything is written; values are checked
+        (and coerced) one column (key) at a time with the type's
+        `coerce_many`, or checked with its `validate_many`. Row numbers for the whole batch are allocated in
+        one step, the slots are written with
+        unordered `insert_many` calls of `chunk_size` documents, and the row
+        index is updated once at the end. A rollback is a single
+        `delete_many` over the row IDs of the batch.
+
+        :see: insert for the parameters.
+
+        :return: Number of rows inserted.
+        """
+        types = {k.id: k.type.instance() for k in self.get_keys()}
+
+        batch = []
+        for slot_row in slot_params:
+            insert_row_id = uuid.uuid4()
+            try:
+                slots = []
+                for slot_args in slot_row:
+                    # The row number is allocated once the batch is valid.
+                    slot = Slot(row_id=insert_row_id, row_num=0, **slot_args)
+                    slot.validate_fields()
+                    inst = types.get(slot.key.id, None)
+                    if inst is None:
+                        raise OneBaseException('E-101',
+                                               message='Key {} is not part '
+                                               'of the node'
+                                               .format(slot.key.id))
+                    slots.append(slot)
+                batch.append((insert_row_id, slots))
+            except Exception as e:
+                if error_action in ('give_up', 'rollback'):
+                    # Nothing has been written yet.
+                    raise e
+                logger.error(e)
+                logger.error('swallow action, so continuing...')
+
+        invalid = self._invalid_rows(batch, types)
+        if invalid:
+            e = OneBaseException('E-101', message='Invalid value {!r}'
+                                 .format(invalid[min(invalid)]))
+            if error_action in ('give_up', 'rollback'):
+                raise e
+            logger.error(e)
+            logger.error('swallow action, skipping {} rows...'
+                         .format(len(invalid)))
+            batch = [row for (i, row) in enumerate(batch) if i not in invalid]
+
+        if not batch:
+            return 0
+        row_nums = self.allocate_rows(len(batch))
+        docs = []
+        for ((insert_row_id, slots), insert_row_num) in zip(batch, row_nums):
+            for slot in slots:
+                slot.row_num = insert_row_num
+                slot.updated = datetime.utcnow()
+                slot.version = 1
+                docs.append(slot.to_mongo().to_dict())
+
+        collection = Slot._get_collection()
+        key_ids = [k.id for k in self.keys]
+        failed = set()
+        for start in range(0, len(docs), chunk_size):
+            chunk = docs[start:start+chunk_size]
+            try:
+                collection.insert_many(chunk, ordered=False)
+            except PyMongoError as e:
+                if error_action == 'give_up':
+                    raise e
+                if error_action == 'rollback':
+                    logger.warn('ROLL BACK {} rows...'.format(len(batch)))
+                    collection.delete_many({
+                        'key': {'$in': key_ids},
+                        'row_id': {'$in': [str(r) for (r, _) in batch]},
+                    })
+                    raise e
+                logger.error(e)
+                logger.error('swallow action, so continuing...')
+                if isinstance(e, BulkWriteError):
+                    failed.update(chunk[err['index']]['row_id']
+                                  for err in e.details.get('writeErrors', []))
+                else:
+                    # Which documents were written is unknown.
+                    failed.update(doc['row_id'] for doc in chunk)
+
+        if failed:
+            # Do not leave half-written rows behind.
+            collection.delete_many({'key': {'$in': key_ids},
+                                    'row_id': {'$in': list(failed)}})
+        written = [r for (r, _) in batch if str(r) not in failed]
+        self.index_rows(*written)
+        return len(written)
+
+    def _invalid_rows(self, batch, types):
+        """ Validate the values of a batch, one column at a time.
+
+        Columns of types with a `coerce_many` are also coerced: the valid
+        slots get the parsed value (e.g. `int`) instead of the given one.
+
+        :param batch: list of `(row_id, slots)`.
+
+        :param types: dict of `{key_id: type instance}`.
+
+        :return: dict of `{index in batch: first invalid value}`.
+        """
+        columns = {}
+        for (i, (_, slots)) in enumerate(batch):
+            for slot in slots:
+                columns.setdefault(slot.key.id, []).append((i, slot))
+        invalid = {}
+        for (key_id, cells) in columns.items():
+            inst = types[key_id]
+            values = [slot.value for (_, slot) in cells]
+            if hasattr(inst, 'coerce_many'):
+                (coerced, rejected) = inst.coerce_many(values)
+                if hasattr(coerced, 'tolist'):
+                    # NumPy scalars cannot be encoded to BSON.
+                    coerced = coerced.tolist()
+            else:
+                (coerced, rejected) = (values, inst.validate_many(values))
+            for ((i, slot), value, bad) in zip(cells, coerced, rejected):
+                if bad:
+                    invalid.setdefault(i, slot.value)
+                elif not (isinstance(value, int)
+                          and not -2**63 <= value < 2**63):
+                    # Integers out of the BSON range are kept as given.
+                    slot.value = value
+        return invalid
+
     @property
     def row_count(self):
         """ Count the number of rows in the Node.
 
-        TODO: This can be very bad for very large row counts since
-        all Slots are loaded if slots.count() > 0 (in order to get
-        the slot row)
+        The count is maintained by `index_rows` and `unindex_rows`, so no
+        Slot has to be read. Row numbers may have gaps (dropped rows, failed
+        inserts), so this is not a bound on row numbers; see `compact_rows`.
 
         """
-        slots = Slot.objects(key__in=self.keys).fields(row=1)
-        # logger.debug('slots: {}'.format(slots.all()))
-        if slots.count() == 0:
-            return 0
-        return max([s.row for s in slots.all()])+1
+        self._backfill_row_total()
+        return self.row_total
 
     def do_select(self, client_id,
                   key_names=None, filter_args=None, limit=100, offset=0,
@@ -299,9 +870,12 @@ class Node(DiscussionMixin, HistoricalMixin, Document):
 
         :param client_id: Primary Key ID of the Client requesting the data.
 
-        :param key_names: Key names to select
+        :param key_names: Key names to select, in order. Only the slots of
+            these keys are read. default: every key of the node.
 
-        :param filter_args: Arguments to filter.
+        :param filter_args: Arguments to filter. See `onebase_api.models.query`
+            for the syntax. The filter is run on the server; only the
+            matching rows are fetched.
 
         :param limit: How many rows to return.
 
@@ -346,44 +920,265 @@ class Node(DiscussionMixin, HistoricalMixin, Document):
 
         """
         self.select_related()
-        # keys = [k for k in self.keys if k.fetch().name in keys]
+        all_keys = list(self.get_keys())
+        keys = self._project_keys(all_keys, key_names)
         rows = idict()
-        if filter_args is None:
-            logger.debug('Selecting rows {} - {}'.format(offset, offset+limit))
-            for rownum in range(offset, min(offset+limit, self.row_count)):
-                logger.debug(' - row # {}'.format(rownum))
-                row = idict()
-                col_num = 0
-                for key_ref in self.get_keys():
-                    # renderer = RendererClass()
-                    key = key_ref
-                    col_num += 1
-                    logger.debug("Selecting for key={}, rownum={}, col_num={}"
-                                 .format(key.id, rownum, col_num))
-                    slot = Slot.objects(key=key.id, row=rownum)
-                    logger.debug('{} slots'.format(slot.count()))
-                    if slot.count() == 0:
-                        continue
-                    if slot.count() > 1:
-                        logger.warn("More than 1 slot returned "
-                                    "(key={}, row={})".format(key, row))
-                    slot = slot.first()
-                    if not expand_keys and not expand_slots:
-                        row[key.name] = slot.value
-                    if expand_keys and not expand_slots:
-                        row[col_num] = [key, slot.value]
-                    if expand_slots:
-                        """ IMPORTANT SECTION """
-                        val = {'value': slot.id,
-                               'attrs': slot.get_attrs(mimetype,
-                                                       **render_kwargs)}
-                        """ END IMPORTANT SECTION """
-                        if expand_keys:
-                            row[col_num] = [key, val]
-                        else:
-                            row[key.name] = val
-                rows[rownum] = row
-            return rows
+        if not filter_args:
+            row_nums = self._page_row_nums(all_keys, offset, limit)
+        else:
+            matches = self._filter_row_nums(all_keys, filter_args,
+                                            limit=offset + limit)
+            row_nums = matches[offset:offset+limit]
+        logger.debug('Selecting rows {}'.format(row_nums))
+        page = self._fetch_page(keys, row_nums)
+        attrs = {}
+        if expand_slots:
+            attrs = self._render_attrs([s for cells in page.values()
+                                        for s in cells.values()],
+                                       mimetype, render_kwargs)
+        for rownum in row_nums:
+            logger.debug(' - row # {}'.format(rownum))
+            rows[rownum] = self._build_row(keys, page.get(rownum, {}),
+                                           expand_keys, expand_slots, attrs)
+        return rows
+
+    def _page_row_nums(self, keys, offset, limit):
+        """ Get the row numbers of a page of rows, in row order.
+
+        Row numbers may have gaps, so the page is taken from the row index
+        (`rows`) and only the slots of its rows are read.
+
+        :param keys: Keys of the node.
+
+        :return: list of row numbers.
+        """
+        if limit <= 0 or not keys:
+            return []
+        self._backfill_row_total()
+        row_ids = self.rows[offset:offset+limit]
+        if not row_ids:
+            return []
+        return sorted(Slot.objects(key__in=[k.id for k in keys],
+                                   row_id__in=row_ids).distinct('row_num'))
+
+    def _project_keys(self, keys, key_names):
+        """ Pick the keys named by `key_names`.
+
+        :param keys: Keys of the node.
+
+        :param key_names: Key names to keep, in order, or None for all keys.
+
+        :return: list of keys.
+        """
+        if not key_names:
+            return keys
+        by_name = {k.name: k for k in keys}
+        missing = [n for n in key_names if n not in by_name]
+        if missing:
+            raise OneBaseException('E-503', value=', '.join(missing),
+                                   key='key_names')
+        return [by_name[n] for n in key_names]
+
+    def _filter_row_nums(self, keys, filter_args, after=None, limit=None):
+        """ Get the row numbers matching `filter_args`.
+
+        :param keys: Keys of the node.
+
+        :param filter_args: Filter, see `onebase_api.models.query`.
+
+        :param after: Only match row numbers greater than `after`.
+
+        :param limit: Only return the first `limit` row numbers.
+
+        :return: sorted list of row numbers.
+        """
+        tree = query.compile_filter(filter_args,
+                                    {k.name: k.id for k in keys})
+        return query.evaluate(tree, Slot._get_collection(), after=after,
+                              limit=limit)
+
+    def iter_select(self, client_id,
+                    key_names=None, filter_args=None, limit=100, after=None,
+                    expand_keys=False, expand_slots=False,
+                    mimetype='application/html', render_kwargs={}):
+        """ Stream rows of a node, using keyset pagination.
+
+        Slots are read from a single server-side cursor sorted by row number
+        and each row is yielded as soon as it is complete, so memory use and
+        the cost per page do not depend on how deep the page is. With
+        `expand_slots` the page is read first and its slots are rendered
+        together (see `_render_attrs`).
+
+        :param after: Continuation token (see `encode_row_token`) of the
+            last row already seen, or None to start at the first row.
+
+        :see: do_select for the remaining parameters.
+
+        :return: Generator of `(row_num, row)` tuples. At most `limit` rows
+            are yielded.
+
+        :raise OneBaseException: right away (not when the generator is first
+            advanced) for unknown `key_names` or an invalid `after` token.
+        """
+        all_keys = list(self.get_keys())
+        keys = self._project_keys(all_keys, key_names)
+        slot_query = dict(key__in=[k.id for k in keys])
+        if after is not None:
+            after = decode_row_token(after)
+            slot_query['row_num__gt'] = after
+        if filter_args:
+            slot_query['row_num__in'] = self._filter_row_nums(
+                all_keys, filter_args, after=after, limit=limit)
+        return self._iter_rows(keys, slot_query, limit, expand_keys,
+                               expand_slots, mimetype, render_kwargs)
+
+    def _iter_rows(self, keys, slot_query, limit, expand_keys, expand_slots,
+                   mimetype, render_kwargs):
+        """ Yield the rows of `iter_select` from a single cursor.
+
+        :param slot_query: Query of the slots of the page.
+
+        :see: iter_select for the remaining parameters.
+        """
+        if not keys or limit <= 0:
+            return
+        # One cursor batch holds a whole page.
+        slots = (Slot.objects(**slot_query).order_by('row_num')
+                 .batch_size(limit * len(keys) + 1))
+        rows = self._group_rows(slots, limit)
+        attrs = {}
+        if expand_slots:
+            # The whole page is rendered at once, under a single deadline.
+            rows = list(rows)
+            attrs = self._render_attrs([s for (_, cells) in rows
+                                        for s in cells.values()],
+                                       mimetype, render_kwargs)
+        for (row_num, cells) in rows:
+            yield (row_num, self._build_row(keys, cells, expand_keys,
+                                            expand_slots, attrs))
+
+    def _group_rows(self, slots, limit):
+        """ Group slots sorted by row number into rows.
+
+        :return: Generator of at most `limit` `(row_num, {key_id: slot})`.
+        """
+        n_rows = 0
+        cells = {}
+        row_num = None
+        for slot in slots:
+            if row_num is not None and slot.row_num != row_num:
+                yield (row_num, cells)
+                n_rows += 1
+                if n_rows >= limit:
+                    return
+                cells = {}
+            row_num = slot.row_num
+            cells.setdefault(slot.key.id, slot)
+        if row_num is not None:
+            yield (row_num, cells)
+
+    def _fetch_page(self, keys, row_nums):
+        """ Fetch every slot of a page of rows with a single query.
+
+        :param keys: Keys (columns) to fetch.
+
+        :param row_nums: `range` or list of row numbers to fetch.
+
+        :return: dict of `{row_num: {key_id: slot}}`. Rows without any slot
+            are omitted.
+        """
+        page = {}
+        if len(row_nums) == 0 or len(keys) == 0:
+            return page
+        if isinstance(row_nums, range):
+            slots = Slot.objects(key__in=[k.id for k in keys],
+                                 row_num__gte=row_nums.start,
+                                 row_num__lt=row_nums.stop)
+        else:
+            slots = Slot.objects(key__in=[k.id for k in keys],
+                                 row_num__in=list(row_nums))
+        for slot in slots:
+            cells = page.setdefault(slot.row_num, {})
+            if slot.key.id in cells:
+                logger.warn("More than 1 slot returned "
+                            "(key={}, row={})".format(slot.key.id,
+                                                      slot.row_num))
+                continue
+            cells[slot.key.id] = slot
+        return page
+
+    def _render_attrs(self, slots, mimetype, render_kwargs):
+        """ Get the attributes of many slots concurrently.
+
+        Each slot may call a remote representer, so the calls run in a
+        thread pool of at most `settings.SELECT_RENDER_CONCURRENCY` threads.
+        Slots not done within `settings.SELECT_RENDER_DEADLINE` seconds get
+        None as their attributes.
+
+        :param slots: Slots to render.
+
+        :return: dict of `{slot_id: attrs}`.
+
+        :raise: The error of the first slot (in `slots` order) that failed
+            to render.
+        """
+        slots = list(slots)
+        if not slots:
+            return {}
+        workers = min(api_settings.SELECT_RENDER_CONCURRENCY, len(slots))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {executor.submit(s.get_attrs, mimetype, **render_kwargs): s
+                   for s in slots}
+        (done, not_done) = wait(futures,
+                                timeout=api_settings.SELECT_RENDER_DEADLINE)
+        for f in not_done:
+            f.cancel()
+        executor.shutdown(wait=False)
+        attrs = {}
+        for (f, slot) in futures.items():
+            attrs[slot.id] = None
+            if f in not_done:
+                logger.warn('Rendering slot {} missed the deadline'
+                            .format(slot.id))
+                continue
+            attrs[slot.id] = f.result()
+        return attrs
+
+    def _build_row(self, keys, cells, expand_keys, expand_slots, attrs):
+        """ Assemble a single row from the slots fetched for it.
+
+        :param keys: Keys (columns) of the row, in order.
+
+        :param cells: dict of `{key_id: slot}` for the row.
+
+        :param attrs: dict of `{slot_id: attrs}`, see `_render_attrs`. Only
+            used with `expand_slots`.
+
+        :see: do_select for the remaining parameters.
+
+        :return: The assembled row.
+        """
+        row = idict()
+        col_num = 0
+        for key in keys:
+            col_num += 1
+            slot = cells.get(key.id, None)
+            if slot is None:
+                continue
+            if not expand_keys and not expand_slots:
+                row[key.name] = slot.value
+            if expand_keys and not expand_slots:
+                row[col_num] = [key, slot.value]
+            if expand_slots:
+                """ IMPORTANT SECTION """
+                val = {'value': slot.id,
+                       'attrs': attrs.get(slot.id, None)}
+                """ END IMPORTANT SECTION """
+                if expand_keys:
+                    row[col_num] = [key, val]
+                else:
+                    row[key.name] = val
+        return row
 
     @property
     def paths(self):
@@ -393,15 +1188,18 @@ class Node(DiscussionMixin, HistoricalMixin, Document):
     def save(self, *args, **kwargs):
         """ Save the current Node.
 
-        :param do_row_sync: Whether to perform row syncronization. default=True
+        :param do_row_sync: Whether to perform row syncronization. Once the
+            node has been syncronized, only slots saved since then are
+            looked at. default=False
 
         :see: HistoricalMixin.save
 
         """
-        super(Node, self).save(*args, **kwargs)
-        if kwargs.get('do_row_sync', False):
-            self.syncronize_rows()
-        super(Node, self).save(*args, **kwargs)
+        if kwargs.pop('do_row_sync', False):
+            self.syncronize_rows(incremental=True)
+        if self.id is None and self.row_total is None:
+            self.row_total = len(self.rows)
+        return super(Node, self).save(*args, **kwargs)
 
 
 class Path(DiscussionMixin, HistoricalMixin, Document):
@@ -415,6 +1213,11 @@ class Path(DiscussionMixin, HistoricalMixin, Document):
     parent = ReferenceField('Path')
     node = ReferenceField(Node)
 
+    meta = {
+        'indexes': [('parent', 'name'), 'node', ],
+        'index_background': True,
+    }
+
     @property
     def paths(self):
         """ Get a QuerySet representing this path's sub-paths. """
@@ -505,6 +1308,53 @@ def create_node_at_path(user, full_path, node):
     return path
 
 
+class RowSequence(Document):
+    """ Atomic row number allocator.
+
+    There is one sequence per Node (`node:<id>`), or per Key for keys that do
+    not belong to a node (`key:<id>`). `value` is the next free row number.
+    """
+
+    name = StringField(primary_key=True)
+    value = IntegerField(default=0)
+
+    @classmethod
+    def allocate(cls, name, count=1, seed=None):
+        """ Allocate `count` consecutive numbers from a sequence.
+
+        :param name: Name of the sequence.
+
+        :param count: How many numbers to allocate.
+
+        :param seed: Optional callable returning the first free number, used
+            when the sequence does not exist yet (e.g. for existing data).
+
+        :return: `range` of the allocated numbers.
+        """
+        seq = cls.objects(name=name).modify(new=True, inc__value=count)
+        if seq is None:
+            initial = seed() if seed is not None else 0
+            cls.objects(name=name).update_one(upsert=True,
+                                              set_on_insert__value=initial)
+            seq = cls.objects(name=name).modify(new=True, inc__value=count)
+        return range(seq.value - count, seq.value)
+
+    @classmethod
+    def reset(cls, name, value, expected=None):
+        """ Move a sequence to `value`.
+
+        :param expected: If given, only reset when the sequence still equals
+            `expected` (i.e. nothing was allocated in the meantime).
+
+        :return: True if the sequence was reset.
+        """
+        criteria = {'name': name}
+        if expected is not None:
+            criteria['value'] = expected
+        return cls.objects(**criteria).update_one(upsert=expected is None,
+                                                  set__value=value) > 0
+
+
 class Slot(DynamicDocument, DiscussionMixin, JsonMixin):
     """ Data value.
 
@@ -522,20 +1372,78 @@ class Slot(DynamicDocument, DiscussionMixin, JsonMixin):
     row_num = IntegerField(max_length=128, unique_with='key', required=True)
     row_id = UUIDField(binary=False, required=True)
     value = DynamicField(required=True)
+    updated = DateTimeField()
+    # Incremented on every save; part of the ETag of the slot's renders.
+    version = IntegerField(default=0)
+
+    # (key, row_num) is indexed through `unique_with`.
+    meta = {
+        'indexes': [
+            ('key', 'row_id'),
+            ('key', 'value'),
+            ('key', 'updated'),
+        ],
+        'index_background': True,
+    }
+
+    def _allocate_row_num(self):
+        """ Allocate a row number for a slot saved without one.
+
+        If the slot belongs to an existing row of its node, that row's
+        number is reused. Otherwise a new number is taken from the node's
+        sequence (or the key's, for keys outside of a node).
+
+        :return: tuple of `(node, row_num, is_new_row)`.
+        """
+        node = self.key.fetch().node
+        if node is None:
+            def seed():
+                last = (Slot.objects(key=self.key).order_by('-row_num')
+                        .only('row_num').first())
+                return 0 if last is None else last.row_num + 1
+            rng = RowSequence.allocate('key:{}'.format(self.key.id), 1, seed)
+            return (None, rng.start, True)
+        if self.row_id is not None:
+            same_row = (Slot.objects(key__in=node.keys, row_id=self.row_id)
+                        .only('row_num').first())
+            if same_row is not None:
+                return (node, same_row.row_num, False)
+        return (node, node.allocate_rows(1).start, True)
+
+    def save(self, user, do_row_sync=True):
+        """ Allocate the row_num and row_id before saving.
+
+        :param do_row_sync: Whether to add a newly allocated row to the
+            node's row index. default=True
+
+        """
+        if self.row_id is None:
+            self.row_id = uuid.uuid4()
+        self.updated = datetime.utcnow()
+        self.version = (self.version or 0) + 1
+        if self.row_num is None:
+            (node, self.row_num, is_new_row) = self._allocate_row_num()
+            logger.debug("Allocated row_num {}".format(self.row_num))
+            if node is not None and is_new_row and do_row_sync:
+                node.index_rows(self.row_id)
+        result = super(Slot, self).save(user)
+        slot_cache.invalidate(str(self.id))
+        return result
+
+    def delete(self, *args, **kwargs):
+        slot_cache.invalidate(str(self.id))
+        return super(Slot, self).delete(*args, **kwargs)
 
-    def __init__(self, *args, **kwargs):
-        if kwargs.get('_created', False):
-            logger.debug("args={}, kwargs={}".format(args, kwargs))
-            kwargs['row'] = kwargs.get('row', kwargs['key'].node.row_count)
-        super(Slot, self).__init__(*args, **kwargs)
+    @classmethod
+    def cached(cls, slot_id):
+        """ Get a slot through the per-process identity map.
 
-    def save(self, user):
-        """ Rearrange the row_num and row_id before saving. """
-        self.row_num = self.row_num or 0
-        while (Slot.objects.filter(key=self.key, row_num=self.row_num)):
-            logger.debug("Incrementing self.row_num")
-            self.row_num = self.row_num + 1
-        return super(Slot, self).save(user)
+        The slot is shared with other readers and must not be modified.
+
+        :return: The Slot, or None if it does not exist.
+        """
+        return slot_cache.get_or_load(
+            str(slot_id), lambda: cls.objects(id=slot_id).first())
 
     @property
     def is_reference(self):
@@ -543,8 +1451,11 @@ class Slot(DynamicDocument, DiscussionMixin, JsonMixin):
 
     @property
     def type(self):
-        logger.debug("slot.type - fetching key {}".format(self.key))
-        return self.key.fetch().type
+        key = Key.cached(self.key.id)
+        if key is None:
+            raise Key.DoesNotExist('Key {} of slot {} does not exist'
+                                   .format(self.key.id, self.id))
+        return key.type
 
     @property
     def is_valid_reference(self):
@@ -583,22 +1494,72 @@ class Slot(DynamicDocument, DiscussionMixin, JsonMixin):
         Validation is a bit unique for 1Base. We're calling a microservice
         (again) to verify the value is valid.
         """
-        inst = self.type()
+        inst = self.type.instance()
         return inst.validate(self.value)
 
+    def validate_fields(self):
+        """ Check the fields of the document (required fields, field
+        types), which `validate` replaces.
+
+        :raise OneBaseException: if a field is invalid.
+        """
+        try:
+            super(Slot, self).validate()
+        except ValidationError as e:
+            raise OneBaseException('E-101', message=str(e))
+
     def prepare(self):
-        inst = self.type()
+        inst = self.type.instance()
         return inst.prepare(self)
 
     def render(self, requested_mimetype='application/html', **kwargs):
-        inst = self.type()
+        inst = self.type.instance()
         return inst.render(self, requested_mimetype, **kwargs)
 
     def respond(self, requested_mimetype='application/html', **kwargs):
-        inst = self.type()
+        inst = self.type.instance()
         return inst.respond(self, requested_mimetype, **kwargs)
 
     def get_attrs(self, requested_mimetype='application/html', **kwargs):
-        inst = self.type()
+        inst = self.type.instance()
         kwargs['requested_mimetype'] = requested_mimetype
         return inst.get_attrs(self, **kwargs)
+
+    @classmethod
+    def get_attrs_many(cls, slot_ids, requested_mimetype='application/html',
+                       **kwargs):
+        """ Get the attributes of many slots.
+
+        The slots are read with one query, and the keys that are not in
+        the key cache with another.
+
+        :param slot_ids: IDs of the slots.
+
+        :return: dict of `{slot_id: attrs}`, with None for slots that do
+            not exist or failed to render.
+        """
+        slot_ids = [str(s) for s in slot_ids]
+        for slot_id in slot_ids:
+            if not ObjectId.is_valid(slot_id):
+                raise OneBaseException('E-503', value=slot_id, key='ids')
+        slots = list(cls.objects(id__in=slot_ids))
+        keys = {}
+        for key_id in {s.key.id for s in slots}:
+            key = key_cache.get(str(key_id))
+            if key is not None:
+                keys[key_id] = key
+        missing = [s.key.id for s in slots if s.key.id not in keys]
+        generation = key_cache.generation
+        for key in Key.objects(id__in=list(set(missing))):
+            key_cache.set(str(key.id), key, generation=generation)
+            keys[key.id] = key
+        attrs = dict.fromkeys(slot_ids)
+        for slot in slots:
+            try:
+                inst = keys[slot.key.id].type.instance()
+                attrs[str(slot.id)] = inst.get_attrs(
+                    slot, requested_mimetype=requested_mimetype, **kwargs)
+            except Exception as e:
+                logger.error('Rendering slot {} failed: {}'
+                             .format(slot.id, e))
+        return attrs
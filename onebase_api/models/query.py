@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+This file is part of 1Base.
+
+1Base is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+1Base is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import heapq
+import itertools
+import logging
+import re
+
+from onebase_common.exceptions import OneBaseException
+from onebase_api import settings
+
+logger = logging.getLogger(__name__)
+
+""" Filter language for `Node.do_select`.
+
+A filter is a dict. Each item is either a key name mapped to a condition, or
+one of the boolean operators `and`/`or` mapped to a list of filters. Items of
+the same dict are AND'ed together. Examples::
+
+    {'COLOR': '#ff0000'}                        # equality
+    {'AGE': {'gte': 18, 'lt': 65}}              # range
+    {'NAME': {'in': ['Ann', 'Bob']}}            # IN
+    {'NAME': {'prefix': 'Jo'}}                  # prefix
+    {'or': [{'AGE': {'lt': 18}}, {'NAME': 'Bob'}]}
+
+"""
+
+OPERATORS = {
+    'eq': lambda v: {'$eq': v},
+    'ne': lambda v: {'$ne': v},
+    'gt': lambda v: {'$gt': v},
+    'gte': lambda v: {'$gte': v},
+    'lt': lambda v: {'$lt': v},
+    'lte': lambda v: {'$lte': v},
+    'in': lambda v: {'$in': list(v)},
+    'prefix': lambda v: {'$regex': '^' + re.escape(str(v))},
+}
+
+BOOLEANS = ('and', 'or')
+
+
+def _compile_condition(key_id, condition):
+    """ Compile the condition of a single key into leaves. """
+    if not isinstance(condition, dict):
+        return [('leaf', key_id, OPERATORS['eq'](condition))]
+    leaves = []
+    for (op, value) in condition.items():
+        if op not in OPERATORS:
+            raise OneBaseException('E-503', value=op, key='filter_args')
+        leaves.append(('leaf', key_id, OPERATORS[op](value)))
+    return leaves
+
+
+def compile_filter(filter_args, key_ids):
+    """ Compile a filter into a tree of Slot queries.
+
+    :param filter_args: Filter, see the module documentation.
+
+    :param key_ids: dict mapping key names to key IDs.
+
+    :return: `('and'|'or', [children])` or `('leaf', key_id, condition)`,
+        where `condition` is the Mongo condition on `Slot.value`.
+    """
+    if not isinstance(filter_args, dict):
+        raise OneBaseException('E-503', value=filter_args, key='filter_args')
+    children = []
+    for (name, condition) in filter_args.items():
+        if name.lower() in BOOLEANS:
+            if not isinstance(condition, (list, tuple)):
+                raise OneBaseException('E-503', value=condition,
+                                       key='filter_args')
+            children.append((name.lower(),
+                             [compile_filter(f, key_ids)
+                              for f in condition]))
+            continue
+        if name not in key_ids:
+            raise OneBaseException('E-503', value=name, key='filter_args')
+        children.extend(_compile_condition(key_ids[name], condition))
+    if len(children) == 1:
+        return children[0]
+    return ('and', children)
+
+
+def _leaf_match(tree, within=None, after=None):
+    """ Get the Slot query of a leaf, restricted to some row numbers. """
+    (_, key_id, condition) = tree
+    match = {'key': key_id, 'value': condition}
+    row_num = {}
+    if after is not None:
+        row_num['$gt'] = after
+    if within is not None:
+        row_num['$in'] = within
+    if row_num:
+        match['row_num'] = row_num
+    return match
+
+
+def _estimate(tree, collection, after=None):
+    """ Estimate how many rows a child of an `and` matches.
+
+    Leaves are counted on the server, up to `settings.QUERY_NARROW_LIMIT`;
+    boolean operators are assumed to match more than any leaf.
+    """
+    limit = settings.QUERY_NARROW_LIMIT
+    if tree[0] != 'leaf':
+        return limit + 1
+    return collection.count_documents(_leaf_match(tree, after=after),
+                                      limit=limit)
+
+
+def evaluate(tree, collection, within=None, after=None, limit=None):
+    """ Find the row numbers matching a compiled filter.
+
+    Each leaf is a single aggregation over the (indexed) Slot collection,
+    grouping its matches by row number, so only the row numbers reach
+    Python. The children of an `and` are evaluated from the most selective
+    (see `_estimate`) on, each one only among the rows matched so far.
+
+    :param tree: Tree returned by `compile_filter`.
+
+    :param collection: pymongo collection of the Slots.
+
+    :param within: Optional list of row numbers to look among.
+
+    :param after: Only match row numbers greater than `after`.
+
+    :param limit: Only return the first `limit` row numbers.
+
+    :return: sorted list of matching row numbers.
+    """
+    op = tree[0]
+    if op == 'leaf':
+        pipeline = [
+            {'$match': _leaf_match(tree, within, after)},
+            {'$group': {'_id': '$row_num'}},
+            {'$sort': {'_id': 1}},
+        ]
+        if limit is not None:
+            pipeline.append({'$limit': limit})
+        result = collection.aggregate(pipeline, allowDiskUse=True)
+        return [r['_id'] for r in result]
+    children = tree[1]
+    if not children:
+        return []
+    if op == 'or':
+        # The first `limit` rows of the union are among the first `limit`
+        # rows of each child.
+        merged = heapq.merge(*[evaluate(child, collection, within, after,
+                                        limit)
+                               for child in children])
+        row_nums = [r for (r, _) in itertools.groupby(merged)]
+        return row_nums if limit is None else row_nums[:limit]
+    children = sorted(children,
+                      key=lambda child: _estimate(child, collection, after))
+    row_nums = within
+    for (i, child) in enumerate(children):
+        last = i == len(children) - 1
+        if row_nums is None or len(row_nums) <= settings.QUERY_NARROW_LIMIT:
+            row_nums = evaluate(child, collection, row_nums, after,
+                                limit if last else None)
+        else:
+            # Too many rows to send back to the server; intersect here.
+            known = set(row_nums)
+            row_nums = [r for r in evaluate(child, collection, None, after)
+                        if r in known]
+            if last and limit is not None:
+                row_nums = row_nums[:limit]
+        if not row_nums:
+            return []
+    return row_nums
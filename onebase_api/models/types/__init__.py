@@ -15,68 +15,175 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
 """
+import ast
+import importlib
+import json
 import logging
 import os
-import sys
-import re
-import importlib.util
-import inspect
-import itertools
+import threading
+import time
+from collections.abc import Mapping
 
-logger = logging.getLogger(__name__)
+from onebase_api import settings
+from onebase_api.models.types._base import (
+    TypeBase,
+    RegexValidationMixin,
+    fits_size,
+)
 
-# from onebase_common.util import in_list
-from onebase_api.models.types._base import (TypeBase, RegexValidationMixin)
+logger = logging.getLogger(__name__)
 
 TypeBase = TypeBase
 RegexValidationMixin = RegexValidationMixin
 
-_SKIPPED_TYPES = [TypeBase, RegexValidationMixin]
+__all__ = ['TypeBase', 'RegexValidationMixin', 'TYPE_SELECTION', 'fits_size']
 
-__all__ = []
+HERE = os.path.dirname(__file__)
 
-TYPE_SELECTION = {}
 
-def recursive_find(item, l):
-    if isinstance(l, (list, tuple)):
-        return any([recursive_find(item, i) for i in l])
-    # logger.debug('`{}` == `{}`? {}'.format(item, l, item.__name__ == l.__name__))
-    return l.__name__ == item.__name__
+def discover(directory):
+    """ Find the type classes of the modules in `directory` without
+    importing them.
 
-HERE = os.path.dirname(__file__)
-type_files = [os.path.join(HERE, f) for f in os.listdir(HERE)
-              if f not in ('__init__.py', '_base.py')]
-for tf in type_files:
-    spec = importlib.util.spec_from_file_location(__name__, tf)
-    if spec is None:
-        logger.warn("Could not load spec from {}".format(tf))
-        continue
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
-    for (ClassName, Class) in vars(module).items():
-        if not inspect.isclass(Class):
-            continue
-        if Class in _SKIPPED_TYPES:
-            logger.debug("Skipping {} since it's abstract".format(ClassName))
-            continue
-        tree = inspect.getclasstree([Class])
-        # logger.debug("Type tree: {}".format(tree))
-        if not recursive_find(TypeBase, tree):
-            logger.warn("I don't think {} is a type of TypeBase."
-                        .format(ClassName))
+    Every class assigning a literal list to `NAMES` is a type; it is
+    selected by the first of its names.
+
+    :return: dict of `{type name: (module name, class name)}`
+    """
+    types = {}
+    for filename in sorted(os.listdir(directory)):
+        (module_name, ext) = os.path.splitext(filename)
+        if ext != '.py' or module_name.startswith('_'):
             continue
-        logger.debug("Adding {} to types".format(ClassName))
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        if not hasattr(Class, 'NAMES'):
-            raise NotImplementedError('{}.NAMES'.format(ClassName))
-        if not isinstance(Class.NAMES, (list, tuple, set)):
-            raise TypeError("{}.NAMES must be an list-like type")
-        TYPE_SELECTION[Class.NAMES[0].upper()] = Class
-        curr_module = sys.modules[__name__]
-        logger.debug('setting `{}.{}={}`'.format(curr_module, ClassName, Class))
-        setattr(curr_module, ClassName, Class)
-
-logger.debug("Loaded the following types:")
-for TS in TYPE_SELECTION.items():
-    logger.debug("{}: {}".format(*TS))
+        path = os.path.join(directory, filename)
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            for statement in node.body:
+                if not (isinstance(statement, ast.Assign)
+                        and any(isinstance(t, ast.Name) and t.id == 'NAMES'
+                                for t in statement.targets)):
+                    continue
+                try:
+                    names = ast.literal_eval(statement.value)
+                except ValueError:
+                    logger.warn('{}.NAMES of {} is not a literal'
+                                .format(node.name, path))
+                    continue
+                if not isinstance(names, (list, tuple, set)) or not names:
+                    raise TypeError('{}.NAMES must be a non-empty list-like '
+                                    'type'.format(node.name))
+                types[list(names)[0].upper()] = (module_name, node.name)
+    return types
+
+
+def load_manifest(directory, manifest_path):
+    """ Discover the types of `directory`, through a cached manifest.
+
+    The manifest is reused while the modification times of the modules
+    match; otherwise the types are rediscovered and the manifest rewritten.
+
+    :param manifest_path: Path of the manifest, or None not to cache it.
+
+    :return: see `discover`
+    """
+    mtimes = {f: os.path.getmtime(os.path.join(directory, f))
+              for f in os.listdir(directory) if f.endswith('.py')}
+    if manifest_path is not None:
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('mtimes') == mtimes:
+                return {name: tuple(entry)
+                        for (name, entry) in manifest['types'].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+    types = discover(directory)
+    if manifest_path is not None:
+        try:
+            with open(manifest_path, 'w') as f:
+                json.dump(dict(mtimes=mtimes, types=types), f)
+        except OSError as e:
+            logger.warn('could not write type manifest {}: {}'
+                        .format(manifest_path, e))
+    return types
+
+
+class TypeRegistry(Mapping):
+    """ Type classes by name, each imported on first use.
+
+    Type modules are found by `discover`. A module is imported at most
+    once, the first time one of its types is looked up, and each type is
+    registered (`TypeBase.register`) when it is loaded.
+    """
+
+    def __init__(self, package, types):
+        """ Construct a new TypeRegistry.
+
+        :param package: Name of the package of the type modules.
+
+        :param types: see `discover`
+
+        """
+        self.package = package
+        self.types = types
+        self.classes = {}
+        self.load_times = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, name):
+        try:
+            return self.classes[name]
+        except KeyError:
+            pass
+        (module_name, class_name) = self.types[name]
+        with self._lock:
+            if name not in self.classes:
+                started = time.monotonic()
+                module = importlib.import_module(
+                    '{}.{}'.format(self.package, module_name))
+                Class = getattr(module, class_name)
+                if not issubclass(Class, TypeBase):
+                    raise TypeError("{} is not a type of TypeBase"
+                                    .format(class_name))
+                Class.register()
+                self.load_times[name] = time.monotonic() - started
+                logger.debug('loaded type {} in {:.3f}s'
+                             .format(name, self.load_times[name]))
+                self.classes[name] = Class
+        return self.classes[name]
+
+    def __iter__(self):
+        return iter(self.types)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __contains__(self, name):
+        return name in self.types
+
+    def by_class_name(self, class_name):
+        """ Get a type by the name of its class, e.g. `IntegerType`. """
+        for (name, (_, cname)) in self.types.items():
+            if cname == class_name:
+                return self[name]
+        raise KeyError(class_name)
+
+
+TYPE_SELECTION = TypeRegistry(
+    __name__, load_manifest(HERE, settings.TYPE_MANIFEST))
+
+
+def __getattr__(name):
+    """ Load type classes imported by name, e.g. `IntegerType`. """
+    try:
+        return TYPE_SELECTION.by_class_name(name)
+    except KeyError:
+        raise AttributeError('module {} has no attribute {}'
+                             .format(__name__, name))
+
+
+logger.debug("Found the following types: {}"
+             .format(', '.join(TYPE_SELECTION)))
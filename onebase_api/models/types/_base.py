@@ -1,22 +1,146 @@
 
 
 import logging
+import os
 import re
+from collections.abc import Iterator
+from functools import lru_cache
 
 from flask import (
-    Response
+    Response,
+    request,
+    has_request_context,
+    stream_with_context,
 )
+from werkzeug.wsgi import wrap_file
+
+from onebase_api.settings import RENDER_STREAM_CHUNK_SIZE
 
 from onebase_common.exceptions import OneBaseException
 from onebase_common.util import mimetype_to_method
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 logger = logging.getLogger(__name__)
 
+# Requested mimetypes are few, so their method names are memoized.
+method_suffix = lru_cache(maxsize=256)(mimetype_to_method)
+
+
+def fits_size(value, size):
+    """ Check a value against the size of its key.
+
+    Shared by the validator routes and the in-process validation of
+    `Type.validate_value`, so both accept the same values.
+
+    :return: True if the string form of `value` is shorter than `size`.
+    """
+    return size is not None and len(str(value)) < size
+
+
+def stream_response(body, mimetype=None, etag=None):
+    """ Make the response of a render.
+
+    File-like renders are streamed in chunks of RENDER_STREAM_CHUNK_SIZE and,
+    when seekable, honour `Range` requests. Iterators are streamed as they
+    are produced. Anything else is sent as is.
+
+    :param body: str, bytes, iterator of chunks or binary file-like object.
+
+    :param mimetype: Mimetype of the response.
+
+    :param etag: Optional strong ETag of the render. It is set before
+        `Range` requests are answered, so that `If-Range` can match it.
+
+    :return: `Response`
+    """
+    if hasattr(body, 'read'):
+        if not has_request_context():
+            response = Response(body.read(), mimetype=mimetype)
+        else:
+            length = None
+            if hasattr(body, 'seekable') and body.seekable():
+                start = body.tell()
+                length = body.seek(0, os.SEEK_END) - start
+                body.seek(start)
+            response = Response(
+                wrap_file(request.environ, body, RENDER_STREAM_CHUNK_SIZE),
+                mimetype=mimetype, direct_passthrough=True)
+            if length is not None:
+                response.content_length = length
+                if etag is not None:
+                    response.set_etag(etag)
+                return response.make_conditional(request, accept_ranges=True,
+                                                 complete_length=length)
+    elif isinstance(body, Iterator):
+        if has_request_context():
+            body = stream_with_context(body)
+        response = Response(body, mimetype=mimetype, direct_passthrough=True)
+    else:
+        response = Response(body, mimetype=mimetype)
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+def as_string_column(values):
+    """ Convert a column of values to a NumPy array of strings.
+
+    :return: tuple of `(strings, lengths)`
+    """
+    strings = np.asarray([str(v) for v in values], dtype=str)
+    return (strings, np.char.str_len(strings))
+
+
+def split_sign(strings):
+    """ Split an optional leading `+`/`-` off a NumPy array of strings.
+
+    :return: tuple of `(negative, body, ok)`, where `ok` is False for
+        strings with more than one leading sign.
+    """
+    first = strings.astype('U1')
+    signed = (first == '+') | (first == '-')
+    body = np.char.lstrip(strings, '+-')
+    n_signs = np.char.str_len(strings) - np.char.str_len(body)
+    return (first == '-', body, n_signs == signed)
+
 class TypeBase(object):
 
     names = None
     maximum_size = 1024
 
+    # Cache-Control of the type's slot renders and attributes. Responses
+    # carry an ETag, so by default caches revalidate them on every use.
+    CACHE_CONTROL = 'public, no-cache'
+
+    # Prefixes of the methods dispatched by mimetype.
+    DISPATCHED = ('get_attrs_', 'render_')
+
+    @classmethod
+    def register(cls):
+        """ Called once when the type is added to TYPE_SELECTION.
+
+        Builds the `{prefix: {method suffix: function}}` dispatch table and
+        the instance shared by every slot of the type.
+        """
+        dispatch = {prefix: {} for prefix in cls.DISPATCHED}
+        for name in dir(cls):
+            for prefix in cls.DISPATCHED:
+                if name.startswith(prefix):
+                    dispatch[prefix][name[len(prefix):]] = getattr(cls, name)
+        cls._dispatch = dispatch
+        cls._instance = cls()
+
+    @classmethod
+    def instance(cls):
+        """ Get the instance shared by every slot of the type. """
+        if '_instance' not in cls.__dict__:
+            cls.register()
+        return cls._instance
+
     def validate(self, value):
         """ Validate a value
 
@@ -28,6 +152,21 @@ class TypeBase(object):
                                    given=len(value))
         return True
 
+    def validate_many(self, values):
+        """ Validate a whole column of values.
+
+        :param values: Values to validate.
+
+        :return: list of booleans, True for each *invalid* value.
+        """
+        mask = []
+        for value in values:
+            try:
+                mask.append(not self.validate(value))
+            except OneBaseException:
+                mask.append(True)
+        return mask
+
     def prepare(self, slot):
         """ Prepare the slot for storage.
 
@@ -40,14 +179,13 @@ class TypeBase(object):
     def _call_function(self, prefix, requested_mimetype, slot,
                        dflt_postfix='default',
                        **kwargs):
-        typename = type(self).__name__
-        mname = prefix + mimetype_to_method(requested_mimetype)
-        dflt_mname = prefix + dflt_postfix
-        if hasattr(self, mname):
-            return getattr(self, mname)(slot, **kwargs)
-        logger.debug('{}.{} not found. Using {}.{}'
-                     .format(typename, mname, typename, dflt_mname))
-        return getattr(self, dflt_mname)(slot, requested_mimetype, **kwargs)
+        if '_dispatch' not in type(self).__dict__:
+            type(self).register()
+        table = self._dispatch[prefix]
+        func = table.get(method_suffix(requested_mimetype), None)
+        if func is not None:
+            return func(self, slot, **kwargs)
+        return table[dflt_postfix](self, slot, requested_mimetype, **kwargs)
 
     def get_attrs(self, slot, requested_mimetype, **kwargs):
         """ Get attributes for the slot.
@@ -72,14 +210,46 @@ class TypeBase(object):
         """
         return self._call_function('render_', requested_mimetype, slot, **kwargs)
 
-    def respond(self, slot, requested_mimetype='application/html', **kwargs):
-        return Response(self.render(slot, requested_mimetype, **kwargs))
+    def respond(self, slot, requested_mimetype='application/html',
+                etag=None, **kwargs):
+        """ Respond with the render of the slot.
+
+        Renders may be returned as iterators or file-like objects, which are
+        streamed out instead of being buffered (see `stream_response`).
+
+        :param etag: Optional ETag of the render, see `stream_response`.
+        """
+        return stream_response(self.render(slot, requested_mimetype,
+                                           **kwargs), etag=etag)
 
 
 class RegexValidationMixin(TypeBase):
 
     EXPRESSION = None
 
+    @classmethod
+    def register(cls):
+        """ Compile EXPRESSION once for the class. """
+        super(RegexValidationMixin, cls).register()
+        cls._match = re.compile(cls.EXPRESSION).match
+
+    @classmethod
+    def matcher(cls):
+        """ Get the compiled `match` function of EXPRESSION. """
+        if '_match' not in cls.__dict__:
+            cls.register()
+        return cls._match
+
     def validate(self, value):
         return (super(RegexValidationMixin, self).validate(value)
-                and re.compile(self.EXPRESSION).match(str(value)) is not None)
+                and self.matcher()(str(value)) is not None)
+
+    def validate_many(self, values):
+        """ Validate a whole column of values in one pass.
+
+        :see: TypeBase.validate_many
+        """
+        match = self.matcher()
+        maximum_size = self.maximum_size
+        return [len(s) > maximum_size or match(s) is None
+                for s in map(str, values)]
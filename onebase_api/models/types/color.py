@@ -16,10 +16,19 @@ You should have received a copy of the GNU General Public License
 along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from io import BytesIO
+
+from flask import (
+    Response,
+    request,
+    has_request_context,
+    )
+
 from onebase_api.models.types import (
     TypeBase,
     RegexValidationMixin,
     )
+from onebase_api.cache import renders
 
 from PIL import Image
 from onebase_common.exceptions import OneBaseException
@@ -41,6 +50,18 @@ class ColorType(RegexValidationMixin):
         }
     DEFAULT_SIZE='small'
 
+    # Swatches change rarely, and are cheap to revalidate when they do.
+    CACHE_CONTROL = 'public, max-age=60'
+
+    # Supported PIL encodings and their mimetypes.
+    ENCODINGS = {
+        'PNG': 'image/png',
+        'GIF': 'image/gif',
+        'JPEG': 'image/jpeg',
+        }
+    # Encodings that cannot store an alpha channel.
+    OPAQUE_ENCODINGS = ('JPEG', )
+
     EXPRESSION = r'^\#[\w\d]{6,8}$'
 
     def prepare(self, slot):
@@ -52,15 +73,67 @@ class ColorType(RegexValidationMixin):
     def get_attrs_default(self, requested_mimetype, slot, **kwargs):
         return {}
 
-    def render_default(self, slot, size=DEFAULT_SIZE, include_alpha=True,
-                       encode='PNG'):
-        if size not in SIZES.keys:
+    def swatch(self, color, size=DEFAULT_SIZE, include_alpha=True,
+               encode='PNG'):
+        """ Get an encoded swatch of a color, rendering it only if it is in
+        neither tier of the render store.
+
+        :param color: `#rrggbb` or `#rrggbbaa`.
+
+        :param size: Key of SIZES.
+
+        :param include_alpha: Keep the alpha channel of the color. Accepts
+            the strings of a query argument.
+
+        :param encode: Key of ENCODINGS.
+
+        :return: tuple of `(etag, content)`
+        """
+        if size not in self.SIZES:
             raise OneBaseException('E-503', value=size, key='size')
-        size = (SIZES[size], SIZES[size]*1.5)
-        value = slot.value
-        pil_mode = 'RGBA'
+        encode = encode.upper()
+        if encode not in self.ENCODINGS:
+            raise OneBaseException('E-503', value=encode, key='encode')
+        if isinstance(include_alpha, str):
+            include_alpha = include_alpha.lower() not in ('0', 'false', 'no')
+        if encode in self.OPAQUE_ENCODINGS:
+            include_alpha = False
+        color = str(color)
         if not include_alpha:
-            value = value[:7]
-            pil_mode = 'RGB'
-        image = Image.new(pil_mode, size, alpha)
-        return image.tobytes(encode)
+            color = color[:7]
+        return renders.get_or_make(
+            ('swatch', color, size, include_alpha, encode),
+            lambda: self._draw(color, size, include_alpha, encode))
+
+    def _draw(self, color, size, include_alpha, encode):
+        width = self.SIZES[size]
+        try:
+            image = Image.new('RGBA' if include_alpha else 'RGB',
+                              (width, int(width * 1.5)), color)
+        except ValueError:
+            raise OneBaseException('E-503', value=color, key='color')
+        output = BytesIO()
+        image.save(output, format=encode)
+        return output.getvalue()
+
+    def render_default(self, slot, requested_mimetype=None,
+                       size=DEFAULT_SIZE, include_alpha=True, encode='PNG',
+                       **kwargs):
+        (_, content) = self.swatch(slot.value, size, include_alpha, encode)
+        return content
+
+    def respond(self, slot, requested_mimetype='application/html',
+                etag=None, size=DEFAULT_SIZE, include_alpha=True, encode='PNG',
+                **kwargs):
+        """ Respond with the swatch and its strong ETag.
+
+        The swatch's own ETag is used instead of the given `etag`.
+        """
+        (etag, content) = self.swatch(slot.value, size, include_alpha, encode)
+        response = Response(content,
+                            mimetype=self.ENCODINGS[encode.upper()])
+        response.set_etag(etag)
+        if has_request_context():
+            response.make_conditional(request, accept_ranges=True,
+                                      complete_length=len(content))
+        return response
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+This file is part of 1Base.
+
+1Base is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+1Base is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+
+from onebase_api.models.types import (
+    TypeBase,
+    RegexValidationMixin,
+    )
+from onebase_api.models.types._base import (
+    np,
+    as_string_column,
+    fits_size,
+    split_sign,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class FloatType(RegexValidationMixin):
+
+    NAMES = [
+        'FLOAT',
+        'REAL',
+    ]
+
+    EXPRESSION = r'^[\-\+]?\d+\.\d+$'
+
+    def get_attrs_application_html(self, slot, **kwargs):
+        return dict(type='text/plain')
+
+    def get_attrs_default(self, requested_mimetype, slot, **kwargs):
+        return {}
+
+    def prepare(self, slot):
+        return str(float(slot.value))
+
+    def render_default(self, slot, requested_mimetype, **kwargs):
+        return str(float(slot.value))
+
+    def coerce_many(self, values, size=None):
+        """ Parse and check a whole column of floats at once.
+
+        :see: IntegerType.coerce_many
+
+        :return: tuple of `(floats, rejected)`: a float64 array (0.0 for
+            rejected values) and a boolean mask of the rejected values.
+        """
+        if np is None:
+            rejected = [r or (size is not None and not fits_size(v, size))
+                        for (v, r) in zip(values, self.validate_many(values))]
+            return ([0.0 if r else float(v)
+                     for (v, r) in zip(values, rejected)], rejected)
+        (strings, lengths) = as_string_column(values)
+        (negative, body, ok) = split_sign(strings)
+        parts = np.char.partition(body, '.')
+        (whole, point, fraction) = (parts[..., 0], parts[..., 1],
+                                    parts[..., 2])
+        rejected = ~(ok & (point == '.')
+                     & np.char.isdecimal(whole) & (np.char.str_len(whole) > 0)
+                     & np.char.isdecimal(fraction)
+                     & (np.char.str_len(fraction) > 0)
+                     & (lengths <= self.maximum_size))
+        if size is not None:
+            rejected |= lengths >= size
+        floats = np.zeros(len(strings), dtype=np.float64)
+        valid = ~rejected
+        floats[valid] = body[valid].astype(np.float64)
+        floats[valid & negative] *= -1
+        return (floats, rejected)
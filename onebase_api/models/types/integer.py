@@ -22,6 +22,12 @@ from onebase_api.models.types import (
     TypeBase,
     RegexValidationMixin,
     )
+from onebase_api.models.types._base import (
+    np,
+    as_string_column,
+    fits_size,
+    split_sign,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +41,9 @@ class IntegerType(RegexValidationMixin):
 
     EXPRESSION = r'^[\-\+]?\d+$'
 
+    # Most digits that always fit in an int64.
+    MAXIMUM_DIGITS = 18
+
     def get_attrs_application_html(self, slot, **kwargs):
         return dict(type='text/plain')
 
@@ -47,3 +56,41 @@ class IntegerType(RegexValidationMixin):
     def render_default(self, slot, requested_mimetype, **kwargs):
         # import pdb; pdb.set_trace()
         return str(int(slot.value))
+
+    def coerce_many(self, values, size=None):
+        """ Parse and check a whole column of integers at once.
+
+        The checks are those of `validate`, vectorised with NumPy. Without
+        NumPy, falls back to `validate_many` and plain lists.
+
+        :param values: Values of the column.
+
+        :param size: Optional size of the Key, checked with `fits_size`.
+
+        :return: tuple of `(integers, rejected)`: an int64 array (0 for
+            rejected values) and a boolean mask of the rejected values.
+            Columns with integers of more than MAXIMUM_DIGITS digits are
+            returned as an object array of Python ints instead.
+        """
+        if np is None:
+            rejected = [r or (size is not None and not fits_size(v, size))
+                        for (v, r) in zip(values, self.validate_many(values))]
+            return ([0 if r else int(v) for (v, r) in zip(values, rejected)],
+                    rejected)
+        (strings, lengths) = as_string_column(values)
+        (negative, body, ok) = split_sign(strings)
+        digits = np.char.str_len(body)
+        rejected = ~(ok & np.char.isdecimal(body) & (digits > 0)
+                     & (lengths <= self.maximum_size))
+        if size is not None:
+            rejected |= lengths >= size
+        valid = ~rejected
+        short = valid & (digits <= self.MAXIMUM_DIGITS)
+        long = valid & ~short
+        integers = np.zeros(len(strings),
+                            dtype=object if long.any() else np.int64)
+        integers[short] = body[short].astype(np.int64)
+        integers[short & negative] *= -1
+        if long.any():
+            integers[long] = [int(s) for s in strings[long]]
+        return (integers, rejected)
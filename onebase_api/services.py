@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+This file is part of 1Base.
+
+1Base is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+1Base is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import bisect
+import os
+import threading
+import time
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    FIRST_COMPLETED,
+    wait,
+)
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from onebase_api import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class ServiceUnavailable(requests.ConnectionError):
+    """ Raised instead of calling a service whose circuit breaker is open.
+    """
+
+
+class ServiceState(object):
+    """ Circuit breaker and latency/error statistics of one service host.
+
+    The breaker opens after `threshold` consecutive failures (connection
+    errors and timeouts; HTTP error statuses are answers, not failures).
+    Once `reset_after` seconds have passed a single trial request is let
+    through: a success closes the breaker, a failure opens it again.
+
+    Not thread-safe by itself; `ServiceClient` holds its lock around it.
+    """
+
+    def __init__(self, threshold, reset_after, buckets):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.buckets = buckets
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.histogram = [0] * (len(buckets) + 1)
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """ Return True if a request may be sent now. """
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self.trial:
+            self.trial = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, seconds, ok):
+        """ Record the outcome of a request that took `seconds`. """
+        self.requests += 1
+        self.histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.trial = False
+        if ok:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.errors += 1
+        self.failures += 1
+        if self.failures >= self.threshold or self.opened_at is not None:
+            if self.opened_at is None:
+                logger.warn('opening circuit breaker after {} failures'
+                            .format(self.failures))
+            self.opened_at = time.monotonic()
+
+    def stats(self):
+        bounds = [str(b) for b in self.buckets] + ['+Inf']
+        return dict(requests=self.requests, errors=self.errors,
+                    rejected=self.rejected, breaker=self.state,
+                    latency=dict(zip(bounds, self.histogram)))
+
+
+class ServiceClient(object):
+    """ Keep-alive HTTP client for the type microservices.
+
+    Connections are pooled per host and reused between calls. A new session
+    is made after a fork, so every worker process has its own pool.
+
+    Every host gets its own timeouts (`settings.SERVICE_TIMEOUTS`), circuit
+    breaker and latency/error histogram, so one misbehaving service cannot
+    tie up every worker.
+    """
+
+    def __init__(self, pool_connections=settings.SERVICE_POOL_CONNECTIONS,
+                 pool_maxsize=settings.SERVICE_POOL_MAXSIZE,
+                 connect_timeout=settings.SERVICE_CONNECT_TIMEOUT,
+                 read_timeout=settings.SERVICE_READ_TIMEOUT):
+        """ Construct a new ServiceClient.
+
+        :param pool_connections: Number of hosts to keep a pool for.
+
+        :param pool_maxsize: Maximum number of connections per host.
+
+        :param connect_timeout: Default connect timeout, in seconds.
+
+        :param read_timeout: Default read timeout, in seconds.
+
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._adapter = None
+        self._executor = None
+        self._services = {}
+
+    @property
+    def session(self):
+        """ Get the session of the current process. """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._session = requests.Session()
+                    self._adapter = HTTPAdapter(
+                        pool_connections=self.pool_connections,
+                        pool_maxsize=self.pool_maxsize,
+                    )
+                    self._session.mount('http://', self._adapter)
+                    self._session.mount('https://', self._adapter)
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.pool_maxsize)
+                    self._services = {}
+                    self._pid = os.getpid()
+        return self._session
+
+    def _service(self, host):
+        """ Get the ServiceState of a host. Call with the lock held. """
+        if host not in self._services:
+            self._services[host] = ServiceState(
+                settings.SERVICE_BREAKER_THRESHOLD,
+                settings.SERVICE_BREAKER_RESET,
+                settings.SERVICE_LATENCY_BUCKETS)
+        return self._services[host]
+
+    def post(self, url, hedge_after=None, **kwargs):
+        """ POST to a service.
+
+        :param url: URL of the service.
+
+        :param hedge_after: Only for idempotent calls. If the response takes
+            longer than this many seconds, send the same request again and
+            use whichever answers first. default: no hedging.
+
+        :param kwargs: Passed to `requests.Session.post`. `timeout` defaults
+            to the timeouts of the host.
+
+        :raise ServiceUnavailable: if the circuit breaker of the host is open.
+
+        :return: `requests.Response`
+        """
+        session = self.session
+        host = urlparse(url).netloc
+        kwargs.setdefault('timeout',
+                          settings.SERVICE_TIMEOUTS.get(host, self.timeout))
+        with self._lock:
+            service = self._service(host)
+            allowed = service.allow()
+        if not allowed:
+            raise ServiceUnavailable('{} is unavailable (circuit breaker '
+                                     'open)'.format(host))
+        if hedge_after is None:
+            return self._send(session, service, url, kwargs)
+        return self._hedged(session, service, url, kwargs, hedge_after)
+
+    def _send(self, session, service, url, kwargs):
+        started = time.monotonic()
+        try:
+            response = session.post(url, **kwargs)
+        except requests.RequestException as e:
+            with self._lock:
+                service.record(time.monotonic() - started, False)
+            raise e
+        with self._lock:
+            service.record(time.monotonic() - started, True)
+        return response
+
+    def _hedged(self, session, service, url, kwargs, hedge_after):
+        """ Send a request, and a second one if the first is slow. """
+        first = self._executor.submit(self._send, session, service, url,
+                                      kwargs)
+        (done, _) = wait([first], timeout=hedge_after)
+        if done:
+            return first.result()
+        logger.debug('hedging request to {}'.format(url))
+        second = self._executor.submit(self._send, session, service, url,
+                                       kwargs)
+        pending = {first, second}
+        error = None
+        while pending:
+            (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                try:
+                    return f.result()
+                except requests.RequestException as e:
+                    error = e
+        raise error
+
+    def pool_stats(self):
+        """ Get statistics about the services and connection pools, per host.
+
+        :return: dict of `{host: {requests, errors, rejected, breaker,
+            latency, connections, idle}}`
+        """
+        stats = {}
+        with self._lock:
+            for (host, service) in self._services.items():
+                stats[host] = service.stats()
+            pools = self._adapter.poolmanager.pools if self._adapter else {}
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is None:
+                    continue
+                host = pool.host
+                if pool.port not in (None, DEFAULT_PORTS.get(pool.scheme)):
+                    host = '{}:{}'.format(pool.host, pool.port)
+                entry = stats.setdefault(host, {})
+                entry['connections'] = pool.num_connections
+                # The queue is pre-filled with None placeholders, one per
+                # connection that was never made.
+                idle = list(pool.pool.queue) if pool.pool else []
+                entry['idle'] = sum(1 for conn in idle if conn is not None)
+        return stats
+
+
+_client = None
+
+
+def get_client():
+    """ Get the ServiceClient shared by the whole process. """
+    global _client
+    if _client is None:
+        _client = ServiceClient()
+    return _client
+
+
+_local_services = {}
+
+
+def register_local_service(path, func):
+    """ Register a service route that is served by this very app.
+
+    :param path: URL path of the route, e.g. `/validate/int`.
+
+    :param func: Function taking the JSON body the route would receive and
+        returning True on success (or raising `OneBaseException`).
+    """
+    _local_services[path.rstrip('/')] = func
+
+
+def local_service(url):
+    """ Get the function serving `url` in-process, if there is one.
+
+    :param url: URL of a service. Relative URLs and URLs whose `host:port`
+        is in `settings.SERVICE_LOCAL_HOSTS` are looked up by path.
+
+    :return: The registered function, or None if `url` must go over HTTP.
+    """
+    if not url:
+        return None
+    parts = urlparse(url)
+    if parts.netloc.lower() not in settings.SERVICE_LOCAL_HOSTS:
+        return None
+    return _local_services.get(parts.path.rstrip('/'), None)
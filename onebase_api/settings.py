@@ -15,3 +15,88 @@
     You should have received a copy of the GNU General Public License
     along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
 """
+
+# Number of Slot documents written per `insert_many` call by bulk inserts
+# (see `Node.insert(..., bulk=True)`).
+INSERT_CHUNK_SIZE = 1000
+
+# Filters of `Node.do_select`: most row numbers matched by one condition
+# that are sent back to the server to narrow the next condition of an `and`
+# (see `onebase_api.models.query.evaluate`).
+QUERY_NARROW_LIMIT = 10000
+
+# Number of rows renumbered per batch by `Node.compact_rows`.
+COMPACT_BATCH_SIZE = 500
+# Seconds after which a `compact_rows` run that did not finish is considered
+# dead, and another run may start.
+COMPACT_LOCK_TIMEOUT = 3600
+
+# HTTP client used to call the type microservices (validators and
+# representers). See `onebase_api.services`.
+#
+# Number of hosts to keep a connection pool for.
+SERVICE_POOL_CONNECTIONS = 10
+# Maximum number of keep-alive connections per host.
+SERVICE_POOL_MAXSIZE = 10
+# Timeouts, in seconds.
+SERVICE_CONNECT_TIMEOUT = 3.05
+SERVICE_READ_TIMEOUT = 10
+
+# Number of values sent per request by `Type.validate_values`.
+VALIDATE_BATCH_SIZE = 2000
+
+# Addresses (`host:port`, as written in service URLs) of this very API.
+# Service URLs on these addresses, or without a host, are dispatched
+# in-process when the route is registered with
+# `onebase_api.services.register_local_service`. Other services on the same
+# host (another port) are called over HTTP.
+SERVICE_LOCAL_HOSTS = ('', 'localhost:5002', '127.0.0.1:5002')
+
+# Cache of `Type.represent_value` results: maximum entries and time to live
+# (seconds) of each entry.
+REPR_CACHE_SIZE = 10000
+REPR_CACHE_TTL = 300
+
+# Per-process caches of the Keys and Slots read by the slot routes: maximum
+# entries and time to live (seconds). Saves and deletes invalidate entries
+# of their own process; the TTL bounds how stale other processes can be.
+KEY_CACHE_SIZE = 10000
+KEY_CACHE_TTL = 300
+SLOT_CACHE_SIZE = 10000
+SLOT_CACHE_TTL = 10
+
+# Slot attributes rendered by a select with `expand_slots`: maximum number of
+# concurrent renders per request, and overall deadline (seconds).
+SELECT_RENDER_CONCURRENCY = 16
+SELECT_RENDER_DEADLINE = 10
+
+# Maximum number of slots per `/slot/attrs` batch request.
+SLOT_ATTRS_BATCH_SIZE = 1000
+
+# Store of rendered images (e.g. color swatches): number of renders kept in
+# memory, and directory of the on-disk tier (None keeps them in memory only).
+# The on-disk tier is not size-bounded: give it a dedicated directory and
+# clean it up externally (e.g. by access time).
+RENDER_CACHE_SIZE = 1000
+RENDER_CACHE_DIR = None
+# Bytes read per chunk when streaming file-like slot renders.
+RENDER_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Path of the cached manifest of the type modules (see
+# `onebase_api.models.types`), or None to discover them on every start.
+TYPE_MANIFEST = None
+
+# Resilience of the type microservice calls.
+#
+# Per-host (`host[:port]`) `(connect, read)` timeouts, overriding the ones
+# above.
+SERVICE_TIMEOUTS = {}
+# Consecutive failures after which a host's circuit breaker opens, and
+# seconds before a trial request is let through again.
+SERVICE_BREAKER_THRESHOLD = 5
+SERVICE_BREAKER_RESET = 30
+# Seconds after which a representer call is sent a second time (hedged).
+# None disables hedging.
+SERVICE_HEDGE_AFTER = None
+# Upper bounds (seconds) of the latency histogram buckets.
+SERVICE_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
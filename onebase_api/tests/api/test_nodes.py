@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+This file is part of 1Base.
+
+1Base is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+1Base is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import logging
+from json import loads as ls
+
+from onebase_api.tests.models.base import (
+    CollectionUnitTest,
+    global_setup,
+    fake,
+    )
+
+from onebase_api.models.main import (
+    Node,
+    Key,
+    decode_row_token,
+)
+from onebase_api.api.nodes import stream_rows
+from onebase_api.models.auth import (
+    User,
+    Group,
+)
+from onebase_api import app
+
+global_setup()
+logger = logging.getLogger(__name__)
+
+
+class TestStreamRows(unittest.TestCase):
+
+    def test_body(self):
+        """ The streamed body is a complete ApiResponse JSON document. """
+        body = ls(''.join(stream_rows([(0, {'a': 1}), (1, {'a': 2})], 2)))
+        self.assertEqual(body['data']['rows'], [[0, {'a': 1}], [1, {'a': 2}]])
+        self.assertEqual(decode_row_token(body['data']['next']), 1)
+        body = ls(''.join(stream_rows([], 2)))
+        self.assertEqual(body['data'], {'rows': [], 'next': None})
+
+
+class TestNodeRows(CollectionUnitTest):
+
+    database_name = 'onebase_test_node_rows'
+
+    def setUp(self):
+        group = Group.objects(name='admin').first()
+        if group is None:
+            group = Group(name='admin')
+            group.save()
+        self.admin = User(email=fake.safe_email(), groups=[group, ],
+                          password=fake.password(length=16))
+        self.admin.save()
+        self.key = Key(name='number', soft_type='INTEGER', size=1024)
+        self.key.save(self.admin)
+        self.node = Node(keys=[self.key, ])
+        self.node.save(self.admin)
+        self.node.insert(self.admin,
+                         *[[{'key': self.key, 'value': i}] for i in range(5)],
+                         bulk=True)
+
+    def _get(self, **args):
+        client = app.test_client()
+        resp = client.get('/node/{}/rows'.format(self.node.id),
+                          query_string=args)
+        self.assertEqual(resp.status_code, 200)
+        return ls(resp.data.decode('utf-8'))['data']
+
+    def test_pages(self):
+        """ Rows can be paged through with continuation tokens. """
+        data = self._get(limit=2)
+        self.assertEqual([r[1]['number'] for r in data['rows']], [0, 1])
+        data = self._get(limit=2, after=data['next'])
+        self.assertEqual([r[1]['number'] for r in data['rows']], [2, 3])
+        data = self._get(limit=2, after=data['next'])
+        self.assertEqual([r[1]['number'] for r in data['rows']], [4])
+        self.assertIsNone(data['next'])
+
+    def test_fields(self):
+        """ Only the requested fields are returned. """
+        key = Key(name='other', soft_type='INTEGER', size=1024)
+        key.save(self.admin)
+        self.node.keys.append(key)
+        self.node.save(self.admin)
+        data = self._get(fields='other')
+        self.assertEqual(data['rows'], [])
+        data = self._get(fields='number', limit=1)
+        self.assertEqual(data['rows'], [[0, {'number': 0}]])
+
+    def test_unknown_field(self):
+        """ Unknown fields fail before the response starts streaming. """
+        client = app.test_client()
+        resp = client.get('/node/{}/rows'.format(self.node.id),
+                          query_string={'fields': 'no_such_key'})
+        self.assertNotEqual(resp.status_code, 200)
+        self.assertEqual(ls(resp.data.decode('utf-8'))['status'],
+                         str(resp.status_code))
+
+    def test_invalid_limit(self):
+        """ Limits below 1 are rejected. """
+        client = app.test_client()
+        for limit in (0, -1):
+            resp = client.get('/node/{}/rows'.format(self.node.id),
+                              query_string={'limit': limit})
+            self.assertNotEqual(resp.status_code, 200)
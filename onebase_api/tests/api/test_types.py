@@ -18,6 +18,7 @@ along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
 import logging
+from io import BytesIO
 from json import (dumps as ds, loads as ls)
 from faker import Faker
 fake = Faker()
@@ -45,6 +46,7 @@ from onebase_api.models.types import (
     StringType,
     ColorType,
     )
+from onebase_api.models.types._base import stream_response
 
 from onebase_api import app
 from onebase_api.api.doc import prepend_url as _
@@ -101,6 +103,50 @@ class TestIntType(AccountTestMixin):
             logger.debug("Testing self.invalid_slots[{}]".format(i))
             self.assertFalse(v.validate())
 
+    def test_validate_many(self):
+        """ A column is validated in one pass, returning a failure mask. """
+        values = [fake.pyint(), '-12', '+7', '123.456', {'dictionary': 1}]
+        self.assertListEqual(IntegerType().validate_many(values),
+                             [False, False, False, True, True])
+
+    def test_coerce_many(self):
+        """ A column is parsed into integers with a rejection mask. """
+        (integers, rejected) = IntegerType().coerce_many(
+            ['12', '-7', '+3', '--4', '1.5', '', 42, '123456'], size=5)
+        self.assertListEqual(list(rejected), [False, False, False, True,
+                                              True, True, False, True])
+        self.assertListEqual([int(i) for i in integers],
+                             [12, -7, 3, 0, 0, 0, 42, 0])
+        (integers, rejected) = IntegerType().coerce_many(['1234', '12345'],
+                                                         size=5)
+        self.assertListEqual(list(rejected), [False, True])
+
+    def test_coerce_many_long(self):
+        """ Integers too long for an int64 are parsed as Python ints. """
+        values = ['1234567890123456789', '-123456789012345678901234', '7']
+        (integers, rejected) = IntegerType().coerce_many(values)
+        self.assertFalse(any(rejected))
+        self.assertListEqual(list(integers), [int(v) for v in values])
+        self.assertListEqual(IntegerType().validate_many(values),
+                             [False, False, False])
+
+    def test_registry(self):
+        """ Types are listed before, and registered when, they are loaded. """
+        self.assertIn('COLOR', TYPE_SELECTION)
+        self.assertIs(TYPE_SELECTION['INTEGER'], IntegerType)
+        self.assertIn('INTEGER', TYPE_SELECTION.load_times)
+        self.assertIn('_dispatch', IntegerType.__dict__)
+        self.assertIsNone(TYPE_SELECTION.get('NO_SUCH_TYPE'))
+
+    def test_dispatch(self):
+        """ Slots share one instance and handlers are found by mimetype. """
+        self.assertIs(IntegerType.instance(), IntegerType.instance())
+        self.assertIs(self.valid_slots[0].type.instance(),
+                      IntegerType.instance())
+        table = IntegerType.instance()._dispatch
+        self.assertIn('application_html', table['get_attrs_'])
+        self.assertIn('default', table['render_'])
+
     def test_prepare(self):
         """ Integer requires no preparation. """
         key = Key(name=fake.word(),
@@ -145,3 +191,128 @@ class TestIntType(AccountTestMixin):
         logger.debug('test_api_response body={}'.format(resp.data))
         self.assertEqual(resp.data, str(slot.value))
         self.assertEqual(resp.status_code, 200)
+
+    def test_api_etag(self):
+        """ Renders carry an ETag, which changes when the slot is saved. """
+        client = app.test_client()
+        key = Key(name=fake.word(),
+                  soft_type='INTEGER',
+                  size=1024)
+        key.save(self.user)
+        slot = Slot(key=key, value=fake.pyint())
+        slot.save(self.user)
+        url = '/slot/render/{}'.format(slot.id)
+        resp = client.get(url)
+        etag = resp.headers['ETag']
+        self.assertEqual(resp.headers['Cache-Control'],
+                         IntegerType.CACHE_CONTROL)
+        resp = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        resp = client.get(url + '?mimetype=text/plain',
+                          headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        slot.value = fake.pyint()
+        slot.save(self.user)
+        resp = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_cached(self):
+        """ Keys and slots are reused until they are saved again. """
+        slot = self.valid_slots[0]
+        cached = Slot.cached(slot.id)
+        self.assertIs(Slot.cached(slot.id), cached)
+        self.assertIs(Key.cached(slot.key.id), Key.cached(slot.key.id))
+        slot.value = fake.pyint()
+        slot.save(self.user)
+        self.assertEqual(Slot.cached(slot.id).version, slot.version)
+        key = Key.cached(slot.key.id)
+        key.comment = fake.word()
+        key.save(self.user)
+        self.assertIsNot(Key.cached(slot.key.id), key)
+
+    def test_api_attrs_batch(self):
+        """ Attributes of many slots are returned by one request. """
+        client = app.test_client()
+        missing = '0' * 24
+        ids = [str(s.id) for s in self.valid_slots] + [missing]
+        resp = client.post('/slot/attrs', data=ds({'ids': ids}),
+                           content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        data = ls(resp.data)['data']
+        self.assertSetEqual(set(data), set(ids))
+        self.assertIsNone(data[missing])
+        for s in self.valid_slots:
+            self.assertEqual(data[str(s.id)], {'type': 'text/plain'})
+
+
+class TestColorType(AccountTestMixin):
+
+    database_name='onebase_test_color_type'
+
+    def setUp(self):
+        super(TestColorType, self).setUp()
+        self.user = self.admin
+        self.key = Key(name=fake.word(),
+                       soft_type='COLOR',
+                       size=1024)
+        self.key.save(self.user)
+        self.slot = Slot(key=self.key, value='#336699cc')
+        self.slot.save(self.user)
+
+    def test_swatch(self):
+        """ Swatches are encoded images, rendered once per parameters. """
+        (etag, content) = ColorType().swatch(self.slot.value, 'micro')
+        self.assertTrue(content.startswith(b'\x89PNG'))
+        self.assertEqual(ColorType().swatch(self.slot.value, 'micro'),
+                         (etag, content))
+        (jpeg_etag, jpeg) = ColorType().swatch(self.slot.value, 'micro',
+                                               encode='jpeg')
+        self.assertNotEqual(jpeg_etag, etag)
+
+    def test_api_conditional(self):
+        """ The render route answers 304 to a matching If-None-Match. """
+        client = app.test_client()
+        url = '/slot/render/{}?size=micro'.format(self.slot.id)
+        resp = client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'image/png')
+        (etag, content) = ColorType().swatch(self.slot.value, 'micro')
+        self.assertEqual(resp.headers['ETag'], '"{}"'.format(etag))
+        resp = client.get(url, headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers['ETag'], '"{}"'.format(etag))
+
+
+class TestStreamResponse(unittest.TestCase):
+
+    def test_range(self):
+        """ Seekable renders are streamed and honour Range requests. """
+        body = bytes(range(256)) * 4
+        with app.test_request_context(headers={'Range': 'bytes=10-19'}):
+            resp = stream_response(BytesIO(body), 'application/octet-stream')
+            self.assertEqual(resp.status_code, 206)
+            self.assertEqual(resp.headers['Content-Range'],
+                             'bytes 10-19/1024')
+            self.assertEqual(b''.join(resp.response), body[10:20])
+        with app.test_request_context():
+            resp = stream_response(BytesIO(body))
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(b''.join(resp.response), body)
+
+    def test_if_range(self):
+        """ Range requests conditional on the ETag of the render. """
+        body = bytes(range(256))
+        for (if_range, status) in (('"abc"', 206), ('"other"', 200)):
+            headers = {'Range': 'bytes=0-9', 'If-Range': if_range}
+            with app.test_request_context(headers=headers):
+                resp = stream_response(BytesIO(body), etag='abc')
+                self.assertEqual(resp.status_code, status)
+                self.assertEqual(resp.headers['ETag'], '"abc"')
+
+    def test_iterator(self):
+        """ Iterators are streamed as they are produced. """
+        with app.test_request_context():
+            resp = stream_response(iter([b'a', b'b']))
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(b''.join(resp.response), b'ab')
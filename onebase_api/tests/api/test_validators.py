@@ -18,7 +18,8 @@ along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
 import logging
-from json import dumps as ds
+from unittest.mock import patch
+from json import dumps as ds, loads as ls
 from faker import Faker
 fake = Faker()
 
@@ -37,6 +38,7 @@ from onebase_api.models.main import (
     Slot,
 )
 from onebase_api import app
+from onebase_common.exceptions import OneBaseException
 
 global_setup()
 logger = logging.getLogger(__name__)
@@ -79,6 +81,12 @@ class TestValidators(unittest.TestCase):
                           {'value': 0-i, 'size': len(str(0-i))+1, },
                           {'value': fake.pystr(), 'size': len(str(i))+5, })
 
+    def test_int_sign(self):
+        """ The int route rejects an explicit `+` sign, unlike IntegerType. """
+        self.do_fail_pass(_('/int'),
+                          {'value': '-5', 'size': 5, },
+                          {'value': '+5', 'size': 5, })
+
     def test_str(self):
         s = fake.sentence(nb_words=10)
         self.do_fail_pass(_('/string'),
@@ -93,3 +101,87 @@ class TestValidators(unittest.TestCase):
         self.do_fail_pass(_('/float'),
                           {'value': 0-f, 'size': len(str(0-f))+1, },
                           {'value': fake.pystr(), 'size': len(str(f))+5, })
+
+    def test_float_sign(self):
+        """ The float route rejects an explicit `+` sign, unlike FloatType. """
+        self.do_fail_pass(_('/float'),
+                          {'value': '-5.5', 'size': 5, },
+                          {'value': '+5.5', 'size': 5, })
+
+    def test_batch(self):
+        i = fake.pyint()
+        items = [
+            {'value': i, 'size': len(str(i))+1, },
+            {'value': fake.pystr(), 'size': 100, },
+            {'value': i, 'size': len(str(i))-5, },
+        ]
+        with app.app_context():
+            client = app.test_client()
+            resp = client.post(_('/int/batch'),
+                               content_type='application/json',
+                               data=ds(items))
+            self.assertEqual(resp.status_code, 200)
+            results = ls(resp.data.decode('utf-8'))['data']['results']
+        self.assertEqual([r['valid'] for r in results], [True, False, False])
+        self.assertIsNone(results[0]['error'])
+        self.assertEqual(results[1]['error']['error_code'], 'E-101')
+
+    def test_batch_bad_items(self):
+        """ Malformed items fail alone; 0 is a value like any other. """
+        items = [
+            {'value': 0, 'size': 5, },
+            {'value': 1, 'size': 'abc', },
+            {'value': 1, 'size': None, },
+            {'value': 1, },
+        ]
+        with app.app_context():
+            client = app.test_client()
+            resp = client.post(_('/int/batch'),
+                               content_type='application/json',
+                               data=ds(items))
+            self.assertEqual(resp.status_code, 200)
+            results = ls(resp.data.decode('utf-8'))['data']['results']
+        self.assertEqual([r['valid'] for r in results],
+                         [True, False, False, False])
+        self.assertEqual([r['error']['error_code'] for r in results[1:]],
+                         ['E-503', 'E-102', 'E-102'])
+        self.assertEqual(
+            Type(name='INTEGER_LOCAL',
+                 validator='http://localhost:5002/validate/int')
+            .validate_values([0, 10], 5), [True, True])
+
+    def test_local_type_size(self):
+        """ Built-in types check the size like the validator routes. """
+        int_type = Type(name='INTEGER', validator='')
+        with patch('onebase_api.services.ServiceClient.post') as post:
+            self.assertTrue(int_type.validate_value('1234', 5))
+            with self.assertRaises(OneBaseException):
+                int_type.validate_value('12345', 5)
+            post.assert_not_called()
+        self.verify_response(_('/int'), {'value': '12345', 'size': 5}, 500)
+
+    def test_validate_values_local(self):
+        """ Columns of built-in and in-app validators skip HTTP. """
+        values = ['12', '+3', 'x', '123456']
+        with patch('onebase_api.services.ServiceClient.post') as post:
+            self.assertEqual(
+                Type(name='INTEGER', validator='').validate_values(values, 5),
+                [True, True, False, False])
+            self.assertEqual(
+                Type(name='INTEGER_LOCAL',
+                     validator='http://localhost:5002/validate/int')
+                .validate_values(values, 5),
+                [True, False, False, False])
+            post.assert_not_called()
+        with self.assertRaises(OneBaseException):
+            Type(name='NO_VALIDATOR', validator='').validate_values(values, 5)
+
+    def test_local_dispatch(self):
+        """ Validators served by this app are called in-process. """
+        int_type = Type(name='INTEGER_LOCAL',
+                        validator='http://localhost:5002/validate/int')
+        with patch('onebase_api.services.ServiceClient.post') as post:
+            self.assertTrue(int_type.validate_value('100', 5))
+            with self.assertRaises(OneBaseException):
+                int_type.validate_value('something', 10)
+            post.assert_not_called()
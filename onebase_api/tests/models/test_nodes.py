@@ -18,9 +18,16 @@ along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
 
 # import unittest
 import logging
+import time
 import unittest
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch
 
 from mongoengine import *
+from pymongo.collection import Collection
+from pymongo.errors import AutoReconnect
 
 from onebase_api.models.auth import (
     User,
@@ -31,9 +38,11 @@ from onebase_api.models.main import (
     Key,
     Path,
     Node,
+    Slot,
     create_node_at_path,
 )
 
+from onebase_api.models.types import IntegerType
 from onebase_api.tests.models.base import (
     CollectionUnitTest,
     global_setup,
@@ -48,6 +57,33 @@ global_setup()
 
 logger = logging.getLogger(__name__)
 
+class TestRenderAttrs(unittest.TestCase):
+
+    def test_deadline(self):
+        """ Slots that miss the deadline get None as attrs. """
+        slots = [
+            SimpleNamespace(id=1, get_attrs=lambda mimetype: {'ok': 1}),
+            SimpleNamespace(id=2,
+                            get_attrs=lambda mimetype: time.sleep(1) or {}),
+        ]
+        with patch('onebase_api.settings.SELECT_RENDER_DEADLINE', 0.2):
+            started = time.monotonic()
+            attrs = Node()._render_attrs(slots, 'application/html', {})
+            self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(attrs, {1: {'ok': 1}, 2: None})
+
+    def test_failure(self):
+        """ Render errors are raised, as when rendering slot by slot. """
+        def fail(mimetype):
+            raise OneBaseException('E-101', message='representer down')
+        slots = [
+            SimpleNamespace(id=1, get_attrs=lambda mimetype: {'ok': 1}),
+            SimpleNamespace(id=2, get_attrs=fail),
+        ]
+        with self.assertRaises(OneBaseException):
+            Node()._render_attrs(slots, 'application/html', {})
+
+
 class AccountTestMixin(CollectionUnitTest):
 
     def setUp(self):
@@ -181,3 +217,243 @@ class TestNode(AccountTestMixin):
         ]
         node = Node()
         path = create_node_at_path(self.admin, '/root/a/b', node)
+
+    def _make_node(self, n_rows, key_names=('first', 'second')):
+        keys = []
+        for name in key_names:
+            key = Key(name=name, soft_type='INTEGER', size=1024)
+            key.save(self.admin)
+            keys.append(key)
+        node = Node(keys=keys)
+        node.save(self.admin)
+        for row_num in range(n_rows):
+            row_id = uuid.uuid4()
+            for (col, key) in enumerate(keys):
+                slot = Slot(key=key, row_num=row_num, row_id=row_id,
+                            value=row_num * 10 + col)
+                slot.save(self.admin)
+            node.index_rows(row_id)
+        return (node, keys)
+
+    def test_select_page(self):
+        """ A page of rows is pivoted from the slots of the node. """
+        (node, keys) = self._make_node(5)
+        rows = node.do_select(None, limit=2, offset=1)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1]['first'], 10)
+        self.assertEqual(rows[2]['second'], 21)
+
+    def test_row_count(self):
+        """ Row count follows the row index on insert and drop. """
+        (node, keys) = self._make_node(3)
+        self.assertEqual(node.row_count, 3)
+        self.assertEqual(Node.objects(id=node.id).first().row_count, 3)
+        node.drop_rows(node.rows[0])
+        self.assertEqual(node.row_count, 2)
+        self.assertEqual(Node.objects(id=node.id).first().row_count, 2)
+
+    def test_select_gaps(self):
+        """ Pages skip the row numbers of dropped rows. """
+        (node, keys) = self._make_node(3)
+        node.drop_rows(node.rows[0])
+        rows = node.do_select(None)
+        self.assertEqual(list(rows.keys()), [1, 2])
+        rows = node.do_select(None, limit=1, offset=1)
+        self.assertEqual(list(rows.keys()), [2])
+        self.assertEqual(node.get_row_id(), node.rows[-1])
+
+    def test_row_total_backfill(self):
+        """ Nodes saved before rows were counted are indexed on use. """
+        (node, keys) = self._make_node(3)
+        Node.objects(id=node.id).update_one(unset__row_total=True,
+                                            set__rows=[])
+        node = Node.objects(id=node.id).first()
+        self.assertIsNone(node.row_total)
+        self.assertEqual(node.row_count, 3)
+        self.assertEqual(Node.objects(id=node.id).first().row_total, 3)
+
+    def test_save_after_index(self):
+        """ Saving a node does not overwrite rows indexed by others. """
+        (node, keys) = self._make_node(3)
+        node.drop_rows(node.rows[0])
+        slot = Slot(key=keys[0], value=5)
+        slot.save(self.admin)
+        node.title = 'renamed'
+        node.save(self.admin)
+        node = Node.objects(id=node.id).first()
+        self.assertEqual(node.row_total, 3)
+        self.assertIn(slot.row_id, node.rows)
+
+    def test_row_num_allocation(self):
+        """ Slots saved without a row number get the next free one. """
+        (node, keys) = self._make_node(2)
+        slot = Slot(key=keys[0], value=1)
+        slot.save(self.admin)
+        self.assertEqual(slot.row_num, 2)
+        self.assertEqual(node.reload().row_count, 3)
+        other = Slot(key=keys[1], row_id=slot.row_id, value=2)
+        other.save(self.admin)
+        self.assertEqual(other.row_num, 2)
+        self.assertEqual(node.reload().row_count, 3)
+
+    def test_bulk_insert(self):
+        """ A batch of rows is inserted in chunks and indexed. """
+        (node, keys) = self._make_node(0)
+        batch = [[{'key': keys[0], 'value': i},
+                  {'key': keys[1], 'value': i * 2}] for i in range(7)]
+        n_rows = node.insert(self.admin, *batch, bulk=True, chunk_size=3)
+        self.assertEqual(n_rows, 7)
+        self.assertEqual(node.row_count, 7)
+        self.assertEqual(Slot.objects(key__in=keys).count(), 14)
+        rows = node.do_select(None)
+        self.assertEqual(rows[6]['second'], 12)
+
+    def test_bulk_insert_swallow(self):
+        """ Invalid rows are skipped when errors are swallowed. """
+        (node, keys) = self._make_node(0)
+        batch = [[{'key': keys[0], 'value': 1}],
+                 [{'key': keys[0], 'value': 'not a number'}],
+                 [{'key': keys[0], 'value': 3}]]
+        n_rows = node.insert(self.admin, *batch, bulk=True,
+                             error_action='swallow')
+        self.assertEqual(n_rows, 2)
+        with self.assertRaises(OneBaseException):
+            node.insert(self.admin, *batch, bulk=True)
+        self.assertEqual(node.row_count, 2)
+
+    def test_bulk_insert_rollback(self):
+        """ A chunk lost to a connection error rolls the batch back. """
+        (node, keys) = self._make_node(0)
+        batch = [[{'key': keys[0], 'value': i}] for i in range(4)]
+        insert_many = Collection.insert_many
+        calls = []
+
+        def flaky(collection, docs, **kwargs):
+            calls.append(len(docs))
+            if len(calls) == 2:
+                raise AutoReconnect('connection lost')
+            return insert_many(collection, docs, **kwargs)
+        with patch.object(Collection, 'insert_many', flaky):
+            with self.assertRaises(AutoReconnect):
+                node.insert(self.admin, *batch, bulk=True, chunk_size=2,
+                            error_action='rollback')
+        self.assertEqual(Slot.objects(key=keys[0]).count(), 0)
+        self.assertEqual(node.row_count, 0)
+
+    def test_bulk_insert_columns(self):
+        """ Bulk inserts coerce each column with one coerce_many call. """
+        (node, keys) = self._make_node(0)
+        batch = [[{'key': keys[0], 'value': i},
+                  {'key': keys[1], 'value': str(i)}] for i in range(4)]
+        batch[2][1]['value'] = '2.5'
+        coerce_many = IntegerType.coerce_many
+        with patch.object(IntegerType, 'coerce_many', autospec=True,
+                          side_effect=coerce_many) as mock:
+            n_rows = node.insert(self.admin, *batch, bulk=True,
+                                 error_action='swallow')
+        self.assertEqual(mock.call_count, 2)
+        self.assertEqual(n_rows, 3)
+        self.assertEqual(sorted(Slot.objects(key=keys[0]).distinct('value')),
+                         [0, 1, 3])
+        # The string column is stored coerced to integers.
+        self.assertEqual(sorted(Slot.objects(key=keys[1]).distinct('value')),
+                         [0, 1, 3])
+
+    def test_bulk_insert_required(self):
+        """ Slots missing required fields are not written. """
+        (node, keys) = self._make_node(0, ('text', ))
+        Key.objects(id=keys[0].id).update_one(set__soft_type='STRING')
+        batch = [[{'key': keys[0], 'value': 'a'}],
+                 [{'key': keys[0]}]]
+        with self.assertRaises(OneBaseException):
+            node.insert(self.admin, *batch, bulk=True)
+        self.assertEqual(node.insert(self.admin, *batch, bulk=True,
+                                     error_action='swallow'), 1)
+        self.assertEqual(Slot.objects(key=keys[0]).count(), 1)
+
+    def test_select_filter(self):
+        """ Only rows matching the filter are selected. """
+        (node, keys) = self._make_node(5)
+        rows = node.do_select(None, filter_args={'first': {'gte': 20}})
+        self.assertEqual(list(rows.keys()), [2, 3, 4])
+        rows = node.do_select(None, filter_args={'or': [
+            {'first': 0},
+            {'second': {'in': [31, 41]}},
+        ]})
+        self.assertEqual(list(rows.keys()), [0, 3, 4])
+        rows = node.do_select(None, filter_args={'first': 10, 'second': 21})
+        self.assertEqual(list(rows.keys()), [])
+
+    def test_syncronize_rows(self):
+        """ Rows are rebuilt from the slots, in row order. """
+        (node, keys) = self._make_node(3)
+        expected = list(node.rows)
+        node.rows = []
+        node.syncronize_rows()
+        self.assertEqual(node.rows, expected)
+        self.assertEqual(node.row_total, 3)
+        slot = Slot(key=keys[0], value=5)
+        slot.save(self.admin, do_row_sync=False)
+        node.syncronize_rows(incremental=True)
+        self.assertEqual(node.rows, expected + [slot.row_id])
+
+    def test_compact_rows(self):
+        """ Row numbers are dense again after dropping and compacting. """
+        (node, keys) = self._make_node(5)
+        node.drop_rows(node.rows[1], node.rows[3])
+        self.assertEqual(node.row_count, 3)
+        self.assertEqual(node.compact_rows(batch_size=1), 2)
+        self.assertEqual(sorted(Slot.objects(key=keys[0]).distinct('row_num')),
+                         [0, 1, 2])
+        rows = node.do_select(None)
+        self.assertEqual([r['first'] for r in rows.values()], [0, 20, 40])
+        slot = Slot(key=keys[0], value=50)
+        slot.save(self.admin)
+        self.assertEqual(slot.row_num, 3)
+
+    def test_compact_rows_guard(self):
+        """ Only one compaction of a node runs at a time. """
+        (node, keys) = self._make_node(3)
+        node.drop_rows(node.rows[0])
+        Node.objects(id=node.id).update_one(set__compacting=datetime.utcnow())
+        self.assertEqual(node.compact_rows(), 0)
+        Node.objects(id=node.id).update_one(unset__compacting=True)
+        self.assertEqual(node.compact_rows(), 2)
+        self.assertIsNone(Node.objects(id=node.id).first().compacting)
+
+    def test_compact_rows_inflight(self):
+        """ A row allocated before compacting keeps its row number. """
+        (node, keys) = self._make_node(5)
+        node.drop_rows(node.rows[1])
+        row_num = node.allocate_rows(1).start
+        row_order = Node._row_order
+
+        def write_late(instance, since=None):
+            order = row_order(instance, since)
+            Slot(key=keys[0], value=99, row_num=row_num).save(
+                self.admin, do_row_sync=False)
+            return order
+        with patch.object(Node, '_row_order', write_late):
+            self.assertEqual(node.compact_rows(), 3)
+        slot = Slot(key=keys[0], value=100)
+        slot.save(self.admin)
+        self.assertEqual(slot.row_num, row_num + 1)
+
+    def test_drop_rows_str(self):
+        """ Rows can be dropped by the string form of their row IDs. """
+        (node, keys) = self._make_node(3)
+        dropped = node.rows[1]
+        node.drop_rows(str(dropped))
+        self.assertEqual(node.row_count, 2)
+        self.assertNotIn(dropped, node.rows)
+        self.assertEqual(Node.objects(id=node.id).first().row_count, 2)
+
+    def test_select_key_names(self):
+        """ Only the requested keys are selected. """
+        (node, keys) = self._make_node(2, ('first', 'second', 'third'))
+        rows = node.do_select(None, key_names=['third', 'first'])
+        self.assertEqual(list(rows[1].keys()), ['third', 'first'])
+        self.assertEqual(rows[1]['third'], 12)
+        with self.assertRaises(OneBaseException):
+            # Raised by the call, before any row is read.
+            node.iter_select(None, key_names=['fourth'])
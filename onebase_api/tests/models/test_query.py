@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+This file is part of 1Base.
+
+1Base is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+1Base is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import unittest
+
+from onebase_api.models.query import (
+    compile_filter,
+    evaluate,
+)
+from onebase_common.exceptions import OneBaseException
+
+KEY_IDS = {'COLOR': 1, 'SIZE': 2}
+
+
+class TestCompileFilter(unittest.TestCase):
+
+    def test_equality(self):
+        self.assertEqual(compile_filter({'COLOR': '#ff0000'}, KEY_IDS),
+                         ('leaf', 1, {'$eq': '#ff0000'}))
+        # Operators cannot be passed in as values.
+        self.assertEqual(compile_filter({'COLOR': {'eq': {'$ne': None}}},
+                                        KEY_IDS),
+                         ('leaf', 1, {'$eq': {'$ne': None}}))
+
+    def test_range_and_prefix(self):
+        tree = compile_filter({'SIZE': {'gte': 1, 'lt': 5},
+                               'COLOR': {'prefix': '#ff'}}, KEY_IDS)
+        self.assertEqual(tree, ('and', [
+            ('leaf', 2, {'$gte': 1}),
+            ('leaf', 2, {'$lt': 5}),
+            ('leaf', 1, {'$regex': '^' + re.escape('#ff')}),
+        ]))
+
+    def test_or(self):
+        tree = compile_filter({'or': [{'SIZE': {'in': (1, 2)}},
+                                      {'COLOR': '#000000'}]}, KEY_IDS)
+        self.assertEqual(tree, ('or', [
+            ('leaf', 2, {'$in': [1, 2]}),
+            ('leaf', 1, {'$eq': '#000000'}),
+        ]))
+
+    def test_invalid(self):
+        with self.assertRaises(OneBaseException):
+            compile_filter({'MISSING': 1}, KEY_IDS)
+        with self.assertRaises(OneBaseException):
+            compile_filter({'SIZE': {'like': 1}}, KEY_IDS)
+
+
+class FakeSlots(object):
+    """ Slot collection where each key matches fixed row numbers. """
+
+    def __init__(self, matches):
+        self.matches = matches
+        self.pipelines = []
+
+    def _rows(self, match):
+        rows = self.matches[match['key']]
+        row_num = match.get('row_num', {})
+        if '$gt' in row_num:
+            rows = [r for r in rows if r > row_num['$gt']]
+        if '$in' in row_num:
+            rows = [r for r in rows if r in row_num['$in']]
+        return sorted(rows)
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        self.pipelines.append(pipeline)
+        rows = self._rows(pipeline[0]['$match'])
+        for stage in pipeline[1:]:
+            if '$limit' in stage:
+                rows = rows[:stage['$limit']]
+        return [{'_id': r} for r in rows]
+
+    def count_documents(self, match, limit=0):
+        return min(len(self._rows(match)), limit)
+
+
+class TestEvaluate(unittest.TestCase):
+
+    def test_and_narrows(self):
+        """ The most selective leaf is evaluated first and narrows the rest.
+        """
+        slots = FakeSlots({1: list(range(100)), 2: [3, 50, 70]})
+        tree = ('and', [('leaf', 1, {'$ne': None}), ('leaf', 2, {'$eq': 1})])
+        self.assertEqual(evaluate(tree, slots, after=10, limit=1), [50])
+        (first, second) = [p[0]['$match'] for p in slots.pipelines]
+        self.assertEqual(first['key'], 2)
+        self.assertEqual(first['row_num'], {'$gt': 10})
+        self.assertEqual(second['row_num'], {'$gt': 10, '$in': [50, 70]})
+        self.assertEqual(slots.pipelines[-1][-1], {'$limit': 1})
+
+    def test_or(self):
+        """ The union is sorted, without duplicates, and limited. """
+        slots = FakeSlots({1: [1, 4, 6], 2: [2, 4, 9]})
+        tree = ('or', [('leaf', 1, {'$eq': 1}), ('leaf', 2, {'$eq': 2})])
+        self.assertEqual(evaluate(tree, slots), [1, 2, 4, 6, 9])
+        self.assertEqual(evaluate(tree, slots, limit=3), [1, 2, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+This file is part of 1Base.
+
+1Base is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+1Base is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from onebase_api.cache import (
+    ContentStore,
+    LRUCache,
+    digest,
+)
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_eviction(self):
+        """ The least recently used entry is evicted first. """
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_ttl(self):
+        """ Entries expire after their TTL. """
+        cache = LRUCache(ttl=10)
+        with patch('onebase_api.cache.time.monotonic', return_value=100):
+            cache.set('a', 1)
+        with patch('onebase_api.cache.time.monotonic', return_value=105):
+            self.assertEqual(cache.get('a'), 1)
+        with patch('onebase_api.cache.time.monotonic', return_value=111):
+            self.assertIsNone(cache.get('a'))
+
+    def test_get_or_load(self):
+        """ Loaded values are cached unless invalidated while loading. """
+        cache = LRUCache(maxsize=10)
+        self.assertEqual(cache.get_or_load('a', lambda: 1), 1)
+        self.assertEqual(cache.get_or_load('a', lambda: 2), 1)
+        self.assertIsNone(cache.get_or_load('b', lambda: None))
+        self.assertIsNone(cache.get('b'))
+
+        def racing_load():
+            cache.invalidate('c')
+            return 'stale'
+        self.assertEqual(cache.get_or_load('c', racing_load), 'stale')
+        self.assertIsNone(cache.get('c'))
+
+        generation = cache.generation
+        cache.invalidate('d')
+        self.assertFalse(cache.set('d', 'stale', generation=generation))
+        self.assertIsNone(cache.get('d'))
+        self.assertTrue(cache.set('d', 'fresh', generation=cache.generation))
+
+    def test_invalidate_where(self):
+        cache = LRUCache()
+        cache.set(('INT', 1), 'a')
+        cache.set(('INT', 2), 'b')
+        cache.set(('COLOR', 1), 'c')
+        self.assertEqual(cache.invalidate_where(lambda k: k[0] == 'INT'), 2)
+        self.assertEqual(cache.get(('COLOR', 1)), 'c')
+
+    def test_digest(self):
+        self.assertEqual(digest({'a': 1, 'b': 2}), digest({'b': 2, 'a': 1}))
+        self.assertNotEqual(digest(1), digest('1'))
+
+
+
+class TestContentStore(unittest.TestCase):
+
+    def test_tiers(self):
+        """ Content is made once, then served from memory or disk. """
+        with tempfile.TemporaryDirectory() as directory:
+            made = []
+            make = lambda: made.append(1) or b'content'
+            store = ContentStore(directory, maxsize=10)
+            (address, content) = store.get_or_make(('a', 1), make)
+            self.assertEqual(content, b'content')
+            self.assertEqual(address, digest(('a', 1)))
+            self.assertEqual(store.get_or_make(('a', 1), make),
+                             (address, content))
+            other = ContentStore(directory, maxsize=10)
+            self.assertEqual(other.get_or_make(('a', 1), make),
+                             (address, content))
+            self.assertEqual(len(made), 1)
+            self.assertEqual(other.stats()['disk_hits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
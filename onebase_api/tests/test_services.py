@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+This file is part of 1Base.
+
+1Base is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+1Base is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import socket
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import patch
+
+import requests
+
+from onebase_api.services import (
+    ServiceClient,
+    ServiceState,
+    ServiceUnavailable,
+    local_service,
+    register_local_service,
+)
+
+
+class TestServiceState(unittest.TestCase):
+
+    def _state(self):
+        return ServiceState(threshold=2, reset_after=30, buckets=(0.1, 1))
+
+    @patch('onebase_api.services.time.monotonic', return_value=100)
+    def test_breaker_opens(self, monotonic):
+        """ The breaker opens after `threshold` consecutive failures. """
+        state = self._state()
+        state.record(0.05, False)
+        self.assertTrue(state.allow())
+        state.record(0.05, False)
+        self.assertEqual(state.state, 'open')
+        self.assertFalse(state.allow())
+        self.assertEqual(state.stats()['rejected'], 1)
+
+    def test_breaker_trial(self):
+        """ One trial is let through after `reset_after`; success closes. """
+        state = self._state()
+        with patch('onebase_api.services.time.monotonic', return_value=100):
+            state.record(0.05, False)
+            state.record(0.05, False)
+        with patch('onebase_api.services.time.monotonic', return_value=131):
+            self.assertTrue(state.allow())
+            self.assertFalse(state.allow())
+            state.record(0.5, True)
+            self.assertEqual(state.state, 'closed')
+            self.assertTrue(state.allow())
+
+    def test_histogram(self):
+        state = self._state()
+        state.record(0.05, True)
+        state.record(0.5, True)
+        state.record(5, False)
+        self.assertEqual(state.stats()['latency'],
+                         {'0.1': 1, '1': 1, '+Inf': 1})
+        self.assertEqual(state.stats()['errors'], 1)
+
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestServiceClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), EchoHandler)
+        self.host = '127.0.0.1:{}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_pool_stats(self):
+        """ Requests reuse one pooled connection, reported as idle. """
+        client = ServiceClient(pool_maxsize=10)
+        for i in range(3):
+            response = client.post('http://{}/echo'.format(self.host),
+                                   data=str(i))
+            self.assertEqual(response.text, str(i))
+        stats = client.pool_stats()[self.host]
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_session_per_process(self):
+        """ A forked process gets a session of its own. """
+        client = ServiceClient()
+        session = client.session
+        self.assertIs(client.session, session)
+        with patch('onebase_api.services.os.getpid', return_value=-1):
+            self.assertIsNot(client.session, session)
+
+    @patch('onebase_api.settings.SERVICE_BREAKER_THRESHOLD', 1)
+    def test_breaker(self):
+        """ Calls to a host whose breaker is open are rejected. """
+        client = ServiceClient()
+        # Nothing listens on a port that was just released.
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        host = '127.0.0.1:{}'.format(closed.getsockname()[1])
+        closed.close()
+        url = 'http://{}/echo'.format(host)
+        with self.assertRaises(requests.ConnectionError):
+            client.post(url, data='x')
+        with self.assertRaises(ServiceUnavailable):
+            client.post(url, data='x')
+        self.assertEqual(client.pool_stats()[host]['breaker'], 'open')
+
+    def test_local_service(self):
+        """ Routes of this app are found by path on its own address only. """
+        func = lambda data: True
+        register_local_service('/validate/test_local/', func)
+        self.assertIs(local_service('http://localhost:5002/validate/'
+                                    'test_local'), func)
+        self.assertIs(local_service('/validate/test_local'), func)
+        self.assertIsNone(local_service('http://example.com/validate/'
+                                        'test_local'))
+        # Another service on this host.
+        self.assertIsNone(local_service('http://localhost:9000/validate/'
+                                        'test_local'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,3 +15,26 @@
     You should have received a copy of the GNU General Public License
     along with 1Base.  If not, see <http://www.gnu.org/licenses/>.
 """
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def run_in_background(func, *args, **kwargs):
+    """ Run a function in a daemon thread.
+
+    Exceptions are logged instead of being lost with the thread.
+
+    :return: The started thread.
+    """
+    def target():
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            logger.exception('background job {} failed: {}'
+                             .format(func.__name__, e))
+    thread = threading.Thread(target=target, name=func.__name__, daemon=True)
+    thread.start()
+    return thread